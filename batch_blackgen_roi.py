@@ -1,10 +1,13 @@
 import os
+import shlex
 import subprocess
 from itertools import product
 from config import settings
 
 import yaml
 
+from worker import run_script
+
 x264_dir = settings.x264_dir
 
 # v_list = ['dashcam_%d_test' % (i+1) for i in range(4)] + ['trafficcam_%d_test' % (i+1) for i in range(4)]
@@ -155,21 +158,31 @@ for conv, bound, base, v in product(conv_list, bound_list, base_list, v_list):
     if not os.path.exists(output):
     # if True:
 
-        os.system(
-            f"python compress_blackgen_roi.py -i {v}_qp_{high}.mp4 "
-            f" {v}_qp_{high}.mp4 -s {v} -o {output} --tile_size {tile}  -p maskgen_pths/{model_name}.pth.best"
-            f" --conv_size {conv} "
-            f" -g {v}_qp_{high}.mp4 --bound {bound} --hq {high} --lq {base} --smooth_frames 10 --app {app_name} "
-            f"--maskgen_file maskgen/{filename}.py --visualize_step_size {visualize_step_size}"
+        # runs on the worker if one is started (python worker.py serve)
+        run_script(
+            "compress_blackgen_roi.py",
+            shlex.split(
+                f"-i {v}_qp_{high}.mp4 "
+                f" {v}_qp_{high}.mp4 -s {v} -o {output} --tile_size {tile}  -p maskgen_pths/{model_name}.pth.best"
+                f" --conv_size {conv} "
+                f" -g {v}_qp_{high}.mp4 --bound {bound} --hq {high} --lq {base} --smooth_frames 10 --app {app_name} "
+                f"--maskgen_file maskgen/{filename}.py --visualize_step_size {visualize_step_size}"
+            ),
         )
 
-    os.system(
-        f"python inference.py -i {output} --app {app_name} --confidence_threshold {conf_thresh} --gt_confidence_threshold {gt_conf_thresh} --visualize_step_size {visualize_step_size} "
-        # f" --visualize --lq_result {v}_qp_{base}.mp4 --ground_truth {v}_qp_{high}.mp4"
+    run_script(
+        "inference.py",
+        shlex.split(
+            f"-i {output} --app {app_name} --confidence_threshold {conf_thresh} --gt_confidence_threshold {gt_conf_thresh} --visualize_step_size {visualize_step_size} "
+            # f" --visualize --lq_result {v}_qp_{base}.mp4 --ground_truth {v}_qp_{high}.mp4"
+        ),
     )
 
-    os.system(
-        f"python examine.py -i {output} -g {v}_qp_{high}.mp4 --confidence_threshold {conf_thresh}  --gt_confidence_threshold {gt_conf_thresh} --app {app_name} --stats {stats}"
+    run_script(
+        "examine.py",
+        shlex.split(
+            f"-i {output} -g {v}_qp_{high}.mp4 --confidence_threshold {conf_thresh}  --gt_confidence_threshold {gt_conf_thresh} --app {app_name} --stats {stats}"
+        ),
     )
 
     # if not os.path.exists(f"diff/{output}.gtdiff.mp4"):
@@ -7,6 +7,7 @@ import gc
 import importlib
 import logging
 import time
+from contextlib import ExitStack
 from pathlib import Path
 
 import coloredlogs
@@ -23,12 +24,25 @@ from tqdm import tqdm
 
 from dnn.dnn_factory import DNN_Factory
 from utilities.bbox_utils import center_size
-from utilities.compressor import h264_roi_compressor_segment
+from utilities.compressor import ROISegmentEncoder, h264_roi_compressor_segment
+from utilities.heat_cache import heat_key, load_heat, save_heat
 from utilities.loss_utils import focal_loss as get_loss
 from utilities.mask_utils import *
+from utilities.maskgen_utils import (
+    backends,
+    calibration_frames,
+    generate_heat,
+    load_mask_generator,
+)
 from utilities.results_utils import read_ground_truth, read_results
 from utilities.timer import Timer
-from utilities.video_utils import get_qp_from_name, read_videos, write_video
+from utilities.video_utils import (
+    frame_size,
+    get_qp_from_name,
+    read_videos,
+    unbatch,
+    write_video,
+)
 from utilities.visualize_utils import (
     visualize_dist_by_summarywriter,
     visualize_heat_by_summarywriter,
@@ -39,148 +53,323 @@ thresh_list = [0.01, 0.02, 0.05, 0.1, 0.2, 0.4, 0.8]
 sns.set()
 
 
+def policy_frames(num, policy):
+    """
+        The frames of a segment of num frames that a smoothing policy reads.
+    """
+
+    if policy == "first_last":
+        return [0, num - 1]
+    elif policy == "quadrants":
+        return [0, num // 3, (2 * num) // 3, num - 1]
+    else:
+        assert policy == "mean"
+        return list(range(num))
+
+
+def smooth_mask(mask_slice, policy="first_last"):
+    """
+        Propose one single mask for all frames of the segment, in place.
+    """
+
+    num = mask_slice.shape[0]
+    frames = policy_frames(num, policy)
+
+    mask_slice[:, :, :, :] = sum(
+        mask_slice[i : i + 1, :, :, :] for i in frames
+    ) / len(frames)
+
+
+def segment_qp(mask_slice, args):
+    """
+        Turn the smoothed heat of a segment into its [N, H, W] qp mask.
+        Every step is per frame, so segments can be finalized independently.
+    """
+
+    mask_slice = (mask_slice > args.bound).float()
+    mask_slice = dilate_binarize(mask_slice, 0.5, args.conv_size, cuda=False)
+    mask_slice = postprocess_mask(mask_slice)
+    mask_slice = (mask_slice > 0.5).int()
+    mask_slice = torch.where(
+        mask_slice == 1,
+        args.hq * torch.ones_like(mask_slice),
+        args.lq * torch.ones_like(mask_slice),
+    )
+    return mask_slice.squeeze(1)
+
+
 def main(args):
 
+    # the worker runs many jobs in one process, so close the writer's thread
+    # and event file after each.
+    with SummaryWriter(f"runs/{args.app}/{args.output}") as writer:
+        compress(args, writer)
+
+
+def compress(args, writer):
+
     gc.enable()
 
     # initialize
     logger = logging.getLogger("blackgen")
-    logger.addHandler(logging.FileHandler("blackgen.log"))
+    # main may run many times in one worker process.
+    if not logger.handlers:
+        logger.addHandler(logging.FileHandler("blackgen.log"))
     torch.set_default_tensor_type(torch.FloatTensor)
 
+    keep = None
+    if args.sparse:
+        # only convert the frames that the smoothing reads or that are
+        # visualized.
+        def keep(idx, nframes):
+            st = idx - idx % args.smooth_frames
+            num = min(args.smooth_frames, nframes - st)
+            return (
+                idx - st in policy_frames(num, args.smooth_policy)
+                or (args.start + idx) % args.visualize_step_size == 0
+            )
+
     # read the video frames (will use the largest video as ground truth)
-    videos, bws, video_names = read_videos(args.inputs, logger, sort=True)
+    videos, bws, video_names = read_videos(
+        args.inputs,
+        logger,
+        sort=True,
+        start=args.start,
+        end=args.end,
+        # the generator's batches travel from the decoder as uint8. Partially
+        # converted videos are read frame by frame.
+        batch_size=None if args.sparse else args.batch_size,
+        size=args.maskgen_input_size,
+        keep=keep,
+    )
     videos = videos
     bws = [0, 1]
     qps = [get_qp_from_name(video_name) for video_name in video_names]
+    # frames are visualized at the resolution of the source.
+    source_size = frame_size(video_names[-1])
 
     # construct applications
-    app = DNN_Factory().get_model(args.app)
-
-    maskgen_spec = importlib.util.spec_from_file_location(
-        "maskgen", args.maskgen_file
-    )
-    maskgen = importlib.util.module_from_spec(maskgen_spec)
-    maskgen_spec.loader.exec_module(maskgen)
-    mask_generator = maskgen.FCN()
-    mask_generator.load(args.path)
-    # mask_generator.eval()
-    mask_generator.cuda()
+    app = DNN_Factory().get_accuracy(args.app)
 
     cached_images = []
 
-    # construct the mask
-    mask_shape = [
-        len(videos[-1]),
-        1,
-        720 // args.tile_size,
-        1280 // args.tile_size,
-    ]
-    mask = torch.ones(mask_shape).float()
-
-    # construct the writer for writing the result
-    writer = SummaryWriter(f"runs/{args.app}/{args.output}")
+    # the heat of the generator does not depend on how it is binarized.
+    key = heat_key(video_names[-1], args)
+    heat = None if args.no_heat_cache else load_heat(key)
 
-    for temp in range(1):
-
-        logger.info(f"Processing application")
-        progress_bar = enlighten.get_manager().counter(
-            total=len(videos[-1]), desc=f"{app.name}", unit="frames"
+    if heat is not None:
+        logger.info("Load the heat of %s from the cache.", video_names[-1])
+        mask = heat
+    else:
+        calibration = None
+        if args.maskgen_backend == "int8":
+            calibration = calibration_frames(
+                video_names[-1],
+                logger,
+                args.calibration_frames,
+                args.maskgen_input_size,
+            )
+        mask_generator = load_mask_generator(
+            args.maskgen_file, args.path, args.maskgen_backend, calibration
         )
+        # mask_generator.eval()
+        if args.batch_size > 1:
+            # batch statistics would mix the frames of a batch.
+            logger.info("Use running batchnorm statistics to batch frames.")
+            mask_generator.eval()
+
+        # construct the mask
+        mask_shape = [
+            len(videos[-1]),
+            1,
+            720 // args.tile_size,
+            1280 // args.tile_size,
+        ]
+        mask = torch.ones(mask_shape).float()
+
+    # closes the streaming encoder, without merging if anything fails.
+    with ExitStack() as stack:
+
+        if args.streaming:
+            assert (
+                args.bound is not None
+            ), "--perc needs the mask of all frames."
+            assert args.hq != -1 and args.lq != -1
+            # encode each segment while the masks of the next ones are
+            # generated.
+            encoder = stack.enter_context(ROISegmentEncoder(args, logger))
+
+        for temp in range(1):
+
+            if heat is not None:
+                break
+
+            logger.info(f"Processing application")
+            progress_bar = enlighten.get_manager().counter(
+                total=len(videos[-1]), desc=f"{app.name}", unit="frames"
+            )
 
-        # application.cuda()
-
-        losses = []
-        f1s = []
-
-        for fid, (video_slices, mask_slice) in enumerate(
-            zip(zip(*videos), mask.split(1))
-        ):
-
-            progress_bar.update()
-
-            lq_image, hq_image = video_slices[0], video_slices[1]
-            # lq_image = T.ToTensor()(Image.open('youtube_videos/train_pngs_qp_34/%05d.png' % (fid+offset2)))[None, :, :, :]
-
-            # construct hybrid image
-            with torch.no_grad():
-                # gt_result = application.inference(hq_image.cuda(), detach=True)[0]
-                # _, _, boxes, _ = application.filter_results(
-                #     gt_result, args.confidence_threshold
-                # )
-                # boxes = center_size(boxes)
-
-                # size1 = boxes[:, 2] * boxes[:, 3]
-                # sum1s.append(size1.sum())
-                # boxes[:, 2:] = boxes[:, 2:] + 7 * args.tile_size
-                # size2 = boxes[:, 2] * boxes[:, 3]
-                # sum2s.append(size2.sum())
-                # # ratios.append(size2.sum() / size1.sum())
-                # mask_slice[:, :, :, :] = generate_mask_from_regions(
-                #     mask_slice, boxes, 0, args.tile_size
-                # )
-
-                # mask_gen = mask_generator(
-                #     torch.cat([hq_image, hq_image - lq_image], dim=1).cuda()
-                # )
-                hq_image = hq_image.cuda()
-                # mask_generator = mask_generator.cpu()
-                # with Timer("maskgen", logger):
-                mask_gen = mask_generator(hq_image)
-                # losses.append(get_loss(mask_gen, ground_truth_mask[fid]))
-                mask_gen = mask_gen.softmax(dim=1)[:, 1:2, :, :]
-                # mask_lb = dilate_binarize(mask_gen, args.bound, args.conv_size)
-                # mask_ub = dilate_binarize(mask_gen, args.upper_bound, args.conv_size)
-                mask_slice[:, :, :, :] = mask_gen
-                # mask_slice[:, :, :, :] = torch.where(mask_gen > 0.5, torch.ones_like(mask_gen), torch.zeros_like(mask_gen))
-
-            # visualization
-            if fid % args.visualize_step_size == 0:
-
-                image = T.ToPILImage()(video_slices[-1][0, :, :, :])
-                cached_images.append(image)
-
-                mask_slice = mask_slice.detach().cpu()
-
-                writer.add_image("raw_frame", video_slices[-1][0, :, :, :], fid)
-
-                visualize_heat_by_summarywriter(
-                    image, mask_slice, "inferred_saliency", writer, fid, args,
-                )
-
-                visualize_dist_by_summarywriter(
-                    mask_slice, "saliency_dist", writer, fid,
-                )
-
-                mask_slice = sum(
-                    [(mask_slice > thresh).float() for thresh in thresh_list]
+            # application.cuda()
+
+            losses = []
+            f1s = []
+
+            # frames waiting for the generator, as (index in mask, frame).
+            pending = []
+
+            def flush():
+                if pending:
+                    idxs = [idx for idx, _ in pending]
+                    mask[idxs] = generate_heat(
+                        mask_generator, [image for _, image in pending]
+                    )
+                    pending.clear()
+
+            # the number of frames, from the start, that were submitted to
+            # the encoder.
+            encoded = 0
+            idx = -1
+
+            # mask[i] is the mask of frame args.start + i.
+            for fid, (video_slices, mask_slice) in enumerate(
+                zip(zip(*[unbatch(video) for video in videos]), mask.split(1)),
+                start=args.start,
+            ):
+
+                progress_bar.update()
+
+                lq_image, hq_image = video_slices[0], video_slices[1]
+                # lq_image = T.ToTensor()(Image.open('youtube_videos/train_pngs_qp_34/%05d.png' % (fid+offset2)))[None, :, :, :]
+
+                # construct hybrid image
+                with torch.no_grad():
+                    # gt_result = application.inference(hq_image.cuda(), detach=True)[0]
+                    # _, _, boxes, _ = application.filter_results(
+                    #     gt_result, args.confidence_threshold
+                    # )
+                    # boxes = center_size(boxes)
+
+                    # size1 = boxes[:, 2] * boxes[:, 3]
+                    # sum1s.append(size1.sum())
+                    # boxes[:, 2:] = boxes[:, 2:] + 7 * args.tile_size
+                    # size2 = boxes[:, 2] * boxes[:, 3]
+                    # sum2s.append(size2.sum())
+                    # # ratios.append(size2.sum() / size1.sum())
+                    # mask_slice[:, :, :, :] = generate_mask_from_regions(
+                    #     mask_slice, boxes, 0, args.tile_size
+                    # )
+
+                    # mask_gen = mask_generator(
+                    #     torch.cat([hq_image, hq_image - lq_image], dim=1).cuda()
+                    # )
+                    # frames skipped by --sparse are empty.
+                    if hq_image.numel() > 0:
+                        pending.append((fid - args.start, hq_image))
+                    # mask_slice[:, :, :, :] = torch.where(mask_gen > 0.5, torch.ones_like(mask_gen), torch.zeros_like(mask_gen))
+
+                # the heat of a frame is needed once it is visualized, once its
+                # segment is encoded, and at the end.
+                idx = fid - args.start
+                last = idx + 1 == len(mask)
+                segment_end = last or (idx + 1) % args.smooth_frames == 0
+                if (
+                    len(pending) == args.batch_size
+                    or fid % args.visualize_step_size == 0
+                    or (args.streaming and segment_end)
+                ):
+                    flush()
+
+                # visualization
+                if fid % args.visualize_step_size == 0:
+
+                    frame = video_slices[-1]
+                    if args.maskgen_input_size is not None:
+                        frame = F.interpolate(frame, source_size)
+                    image = T.ToPILImage()(frame[0, :, :, :])
+                    cached_images.append(image)
+
+                    mask_slice = mask_slice.detach().cpu()
+
+                    writer.add_image("raw_frame", frame[0, :, :, :], fid)
+
+                    visualize_heat_by_summarywriter(
+                        image,
+                        mask_slice,
+                        "inferred_saliency",
+                        writer,
+                        fid,
+                        args,
+                    )
+
+                    visualize_dist_by_summarywriter(
+                        mask_slice, "saliency_dist", writer, fid,
+                    )
+
+                    mask_slice = sum(
+                        [
+                            (mask_slice > thresh).float()
+                            for thresh in thresh_list
+                        ]
+                    )
+
+                    visualize_heat_by_summarywriter(
+                        image,
+                        mask_slice,
+                        "binarized_saliency",
+                        writer,
+                        fid,
+                        args,
+                    )
+
+                # the mask of a segment is final once its last frame is
+                # processed.
+                if args.streaming and segment_end:
+                    st = idx - idx % args.smooth_frames
+                    # keep the raw heat for the cache.
+                    segment = mask[st : idx + 1].clone()
+                    smooth_mask(segment, args.smooth_policy)
+                    encoder.submit(segment_qp(segment, args), st)
+                    encoded = idx + 1
+
+            # the frame count in the metadata may exceed the decoded frames,
+            # so the tail is only complete once the decoder is exhausted.
+            flush()
+            if idx + 1 < len(mask):
+                logger.warning(
+                    "Decoded %d frames of %s instead of %d.",
+                    idx + 1,
+                    video_names[-1],
+                    len(mask),
                 )
+                mask = mask[: idx + 1]
+            if args.streaming and encoded < len(mask):
+                segment = mask[encoded:].clone()
+                smooth_mask(segment, args.smooth_policy)
+                encoder.submit(segment_qp(segment, args), encoded)
+
+            logger.info("In video %s", args.output)
+            logger.info(
+                "The average loss is %.3f" % torch.tensor(losses).mean()
+            )
 
-                visualize_heat_by_summarywriter(
-                    image, mask_slice, "binarized_saliency", writer, fid, args,
-                )
+            # application.cpu()
 
-        logger.info("In video %s", args.output)
-        logger.info("The average loss is %.3f" % torch.tensor(losses).mean())
+        if heat is None and not args.no_heat_cache:
+            save_heat(key, mask)
 
-        # application.cpu()
+        if args.streaming:
+            if heat is not None:
+                for st in range(0, len(mask), args.smooth_frames):
+                    segment = mask[st : st + args.smooth_frames].clone()
+                    smooth_mask(segment, args.smooth_policy)
+                    encoder.submit(segment_qp(segment, args), st)
+            return
 
     mask.requires_grad = False
 
     for mask_slice in tqdm(mask.split(args.smooth_frames)):
 
-        num = mask_slice.shape[0]
-
-        # mask_slice[:, :, :, :] = (
-        #     mask_slice[0:1, :, :, :]
-        #     + mask_slice[(num // 3) : (num // 3) + 1, :, :, :]
-        #     + mask_slice[((2 * num) // 3) : ((2 * num) // 3) + 1, :, :, :]
-        #     + mask_slice[num - 1 : num, :, :, :]
-        # ) / 4
-        mask_slice[:, :, :, :] = (
-            mask_slice[0:1, :, :, :] + mask_slice[num - 1 : num, :, :, :]
-        ) / 2
-        # mask_slice[:, :, :, :] = mask_slice.mean(dim=0, keepdim=True)
+        smooth_mask(mask_slice, args.smooth_policy)
 
     # if args.bound is not None:
     #     mask = dilate_binarize(mask, args.bound, args.conv_size, cuda=False)
@@ -217,9 +406,10 @@ def main(args):
 
     logger.info("logging actual quality assignment...")
 
-    for fid, mask_slice in enumerate(tqdm(mask.split(1))):
+    for fid, mask_slice in enumerate(tqdm(mask.split(1)), start=args.start):
 
-        if fid % args.visualize_step_size == 0:
+        # no frame is cached when the heat comes from the cache.
+        if fid % args.visualize_step_size == 0 and cached_images:
 
             image = cached_images[0]
 
@@ -300,13 +490,7 @@ def main(args):
     # write_video(masked_video, args.output, logger)
 
 
-if __name__ == "__main__":
-
-    # set the format of the logger
-    coloredlogs.install(
-        fmt="%(asctime)s [%(levelname)s] %(name)s:%(funcName)s[%(lineno)s] -- %(message)s",
-        level="INFO",
-    )
+def get_parser():
 
     parser = argparse.ArgumentParser()
 
@@ -328,7 +512,25 @@ if __name__ == "__main__":
         type=str,
         required=True,
     )
-    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument(
+        "--maskgen_backend",
+        type=str,
+        help="Run the mask generator with pytorch on the gpu (cuda) or the cpu, with onnxruntime on the cpu (onnx), or quantized to int8 on the cpu (int8).",
+        choices=backends,
+        default="cuda",
+    )
+    parser.add_argument(
+        "--calibration_frames",
+        type=int,
+        help="The number of frames to calibrate the int8 mask generator on.",
+        default=16,
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        help="The number of frames the mask generator processes at once.",
+        default=1,
+    )
     parser.add_argument(
         "-s",
         "--source",
@@ -394,12 +596,64 @@ if __name__ == "__main__":
         default=100,
     )
     parser.add_argument("--conv_size", type=int, default=1)
+    parser.add_argument(
+        "--no_heat_cache",
+        help="Always run the mask generator, and do not cache its heat.",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--smooth_policy",
+        type=str,
+        choices=["first_last", "quadrants", "mean"],
+        help="Which frames of a segment are averaged into its mask.",
+        default="first_last",
+    )
+    parser.add_argument(
+        "--sparse",
+        help="Only run the mask generator on the frames that the smoothing reads.",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--streaming",
+        help="Encode each segment as soon as its mask is final. Needs --bound.",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--maskgen_input_size",
+        type=int,
+        nargs=2,
+        help="Decode the frames at this height and width for the mask generator, e.g. 360 640.",
+        default=None,
+    )
+    parser.add_argument(
+        "--start", type=int, help="The first frame to encode.", default=0,
+    )
+    parser.add_argument(
+        "--end",
+        type=int,
+        help="Encode frames before this one. Defaults to the whole video.",
+        default=None,
+    )
     parser.add_argument("--hq", type=int, default=-1)
     parser.add_argument("--lq", type=int, default=-1)
 
     # parser.add_argument('--mask', type=str,
     #                     help='The path of the ground truth video, for loss calculation purpose.', required=True)
 
-    args = parser.parse_args()
+    return parser
+
+
+if __name__ == "__main__":
+
+    # set the format of the logger
+    coloredlogs.install(
+        fmt="%(asctime)s [%(levelname)s] %(name)s:%(funcName)s[%(lineno)s] -- %(message)s",
+        level="INFO",
+    )
+
+    args = get_parser().parse_args()
 
     main(args)
@@ -0,0 +1,47 @@
+"""
+    Convert pickled inference results to the columnar format (see
+    utilities/results_store.py), in place. Results that cannot be stored in
+    columns (e.g. segmentation masks) are left pickled.
+    python convert_results.py -i results/COCO-Detection/*/videos/*.mp4
+"""
+
+import argparse
+import logging
+
+import coloredlogs
+
+from utilities.results_store import convert
+
+
+def main(args):
+
+    logger = logging.getLogger("convert_results")
+
+    for filename in args.inputs:
+        if convert(filename):
+            logger.info("Converted %s", filename)
+        else:
+            logger.info("Skipped %s", filename)
+
+
+if __name__ == "__main__":
+
+    # set the format of the logger
+    coloredlogs.install(
+        fmt="%(asctime)s [%(levelname)s] %(name)s:%(funcName)s[%(lineno)s] -- %(message)s",
+        level="INFO",
+    )
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-i",
+        "--inputs",
+        type=str,
+        nargs="+",
+        help="The pickled results files to convert.",
+        required=True,
+    )
+
+    args = parser.parse_args()
+
+    main(args)
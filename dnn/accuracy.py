@@ -0,0 +1,600 @@
+"""
+    The accuracy of a model only depends on its type and on the classes it
+    cares about, so results can be examined without building, or even
+    importing, the model. DNN inherits the accuracy computation from here.
+"""
+
+from copy import deepcopy
+
+import torch
+from detectron2.structures.boxes import pairwise_iou
+
+from utilities.results_store import ColumnarResults
+
+coco_class_ids = [0, 1, 2, 3, 5, 6, 7]
+
+# models whose accuracy is fully described by their type and class ids.
+# MobileNet-SSD and Yolo5s filter their results (and Yolo5s computes its
+# accuracy) their own way, so they are built to examine them.
+specs = {
+    "EfficientDet": ("Detection", [0, 1, 2, 3, 4, 6]),
+}
+
+
+def get_spec(name):
+    """
+        Return the type and the class ids of a model, or None if computing its
+        accuracy needs the model itself.
+    """
+    if name in specs:
+        return specs[name]
+    if "yaml" in name:
+        for kind in ["Detection", "Keypoint"]:
+            if kind in name:
+                return kind, coco_class_ids
+    return None
+
+
+def class_aware_iou(result, gt):
+    """
+        The pairwise IoU between the boxes of two Instances, with the IoU of
+        boxes of different classes set to 0.
+    """
+    IoU = pairwise_iou(result.pred_boxes, gt.pred_boxes)
+    mismatch = result.pred_classes[:, None] != gt.pred_classes[None, :]
+    return IoU.masked_fill(mismatch, 0)
+
+
+def batched_pairwise_iou(boxes1, boxes2):
+    """
+        pairwise_iou of detectron2 over a batch of frames, from [F, N, 4] and
+        [F, M, 4] boxes to a [F, N, M] IoU. Same arithmetic, so same values.
+    """
+    area1 = (boxes1[..., 2] - boxes1[..., 0]) * (
+        boxes1[..., 3] - boxes1[..., 1]
+    )
+    area2 = (boxes2[..., 2] - boxes2[..., 0]) * (
+        boxes2[..., 3] - boxes2[..., 1]
+    )
+    width_height = torch.min(
+        boxes1[:, :, None, 2:], boxes2[:, None, :, 2:]
+    ) - torch.max(boxes1[:, :, None, :2], boxes2[:, None, :, :2])
+    width_height.clamp_(min=0)
+    inter = width_height.prod(dim=3)
+    return torch.where(
+        inter > 0,
+        inter / (area1[:, :, None] + area2[:, None, :] - inter),
+        torch.zeros(1, dtype=inter.dtype, device=inter.device),
+    )
+
+
+def pack(lengths, boxes, scores, class_ids):
+    """
+        Pack the concatenated boxes of F frames into [F, N] tensors, where N
+        is the largest number of boxes in a frame, and frame i owns
+        lengths[i] boxes. Return the boxes, scores, class ids and the mask of
+        real boxes.
+    """
+    offsets = lengths.cumsum(0) - lengths
+    frame = torch.repeat_interleave(torch.arange(len(lengths)), lengths)
+    slot = torch.arange(len(frame)) - offsets[frame]
+    # at least one column, so that reductions over boxes are defined.
+    shape = (len(lengths), max(int(lengths.max()), 1))
+
+    def pad(values):
+        padded = values.new_zeros(shape + values.shape[1:])
+        padded[frame, slot] = values
+        return padded
+
+    valid = torch.ones(len(frame), dtype=torch.bool)
+    return pad(boxes), pad(scores), pad(class_ids), pad(valid)
+
+
+def pack_instances(instances_list):
+
+    return pack(
+        torch.tensor([len(instances) for instances in instances_list]),
+        torch.cat(
+            [instances.pred_boxes.tensor for instances in instances_list]
+        ),
+        torch.cat([instances.scores for instances in instances_list]),
+        torch.cat([instances.pred_classes for instances in instances_list]),
+    )
+
+
+def pack_results(results, fids):
+    """
+        Pack the frames fids of results. The boxes of ColumnarResults are
+        gathered from its columns, without building any Instances.
+    """
+    fields = ["pred_boxes", "scores", "pred_classes"]
+    if not isinstance(results, ColumnarResults) or not set(fields) <= set(
+        results.fields
+    ):
+        return pack_instances([results[fid]["instances"] for fid in fids])
+
+    offsets = torch.from_numpy(results.columns["offsets"])
+    rows = torch.tensor([results.index[fid] for fid in fids])
+    starts = offsets[rows]
+    lengths = offsets[rows + 1] - starts
+    # the row of each box in the columns, frame after frame.
+    firsts = lengths.cumsum(0) - lengths
+    shift = torch.repeat_interleave(starts - firsts, lengths)
+    idx = shift + torch.arange(len(shift))
+    return pack(lengths, *[results.column(name)[idx] for name in fields])
+
+
+def summarize_detection(counts):
+    """
+        The detection metrics of a video, from the (true positives, results,
+        ground truths) counts of each frame.
+    """
+
+    f1s = []
+    prs = []
+    res = []
+    tps = []
+    fps = []
+    fns = []
+
+    for tp, num_results, num_gts in counts:
+
+        if num_results == 0 or num_gts == 0:
+            if num_results == 0 and num_gts == 0:
+                f1s.append(1.0)
+                prs.append(1.0)
+                res.append(1.0)
+            else:
+                f1s.append(0.0)
+                prs.append(0.0)
+                res.append(0.0)
+
+        fn = num_gts - tp
+        fp = num_results - tp
+        fp = max(fp, 0)
+
+        if 2 * tp + fp + fn == 0:
+            f1 = 1.0
+        else:
+            f1 = 2 * tp / (2 * tp + fp + fn)
+        if tp + fp == 0:
+            pr = 1.0
+        else:
+            pr = tp / (tp + fp)
+        if tp + fn == 0:
+            re = 1.0
+        else:
+            re = tp / (tp + fn)
+
+        f1s.append(f1)
+        prs.append(pr)
+        res.append(re)
+        tps.append(tp)
+        fps.append(fp)
+        fns.append(fn)
+
+    sum_tp = sum(tps)
+    sum_fp = sum(fps)
+    sum_fn = sum(fns)
+
+    if 2 * sum_tp + sum_fp + sum_fn == 0:
+        sum_f1 = 1.0
+    else:
+        sum_f1 = 2 * sum_tp / (2 * sum_tp + sum_fp + sum_fn)
+
+    return {
+        "f1": torch.tensor(f1s).mean().item(),
+        "pr": torch.tensor(prs).mean().item(),
+        "re": torch.tensor(res).mean().item(),
+        "tp": torch.tensor(tps).sum().item(),
+        "fp": torch.tensor(fps).sum().item(),
+        "fn": torch.tensor(fns).sum().item(),
+        "sum_f1": sum_f1
+        # "f1s": f1s,
+        # "prs": prs,
+        # "res": res,
+        # "tps": tps,
+        # "fns": fns,
+        # "fps": fps,
+    }
+
+
+class Accuracy:
+    def __init__(self, name):
+
+        spec = get_spec(name)
+        assert spec is not None, f"The accuracy of {name} needs the model."
+        self.name = name
+        self.type, self.class_ids = spec
+
+    def filter_result(
+        self,
+        result,
+        args,
+        gt=False,
+        confidence_check=True,
+        require_deepcopy=False,
+        class_check=True,
+    ):
+
+        if require_deepcopy:
+            result = deepcopy(result)
+
+        scores = result["instances"].scores
+        class_ids = result["instances"].pred_classes
+
+        inds = scores < 0
+        if class_check:
+            wanted = torch.tensor(self.class_ids, device=class_ids.device)
+            inds = inds | (class_ids[:, None] == wanted[None, :]).any(dim=1)
+        else:
+            inds = scores > -1
+
+        # if confidence_check:
+        #    if gt:
+        #        inds = inds & (scores > args.gt_confidence_threshold)
+        #    else:
+        #        inds = inds & (scores > args.confidence_threshold)
+
+        if confidence_check:
+            if gt:
+                inds = inds & (scores > args.gt_confidence_threshold)
+            else:
+                inds = inds & (scores > args.confidence_threshold)
+
+        # result["instances"] = result["instances"][inds]
+
+        return {"instances": result["instances"][inds]}
+
+    def calc_accuracy(self, result_dict, gt_dict, args):
+
+        if self.type == "Detection":
+            return self.calc_accuracy_detection_video(
+                result_dict, gt_dict, args
+            )
+        elif self.type == "Keypoint":
+            return self.calc_accuracy_keypoint(result_dict, gt_dict, args)
+
+    def calc_accuracy_sweep(
+        self,
+        result_dict,
+        gt_dict,
+        args,
+        confidence_thresholds,
+        gt_confidence_thresholds,
+    ):
+        """
+            Return {(confidence threshold, gt confidence threshold): metrics}
+            for every pair of thresholds.
+        """
+
+        if self.type == "Detection":
+            return self.calc_accuracy_detection_sweep(
+                result_dict,
+                gt_dict,
+                args,
+                confidence_thresholds,
+                gt_confidence_thresholds,
+            )
+        else:
+            raise NotImplementedError
+
+    # def calc_accuracy_loss(self, image, gt, args):
+
+    #     result = self.inference(image, detach=False, grad=True)
+
+    #     if "Detection" in self.name:
+    #         return self.calc_accuracy_loss_detection(result, gt, args)
+    #     else:
+    #         raise NotImplementedError()
+
+    def calc_accuracy_detection(self, result_dict, gt_dict, args):
+        """
+            Match the boxes of each frame separately. Gives the same metrics as
+            calc_accuracy_detection_video, which is faster on whole videos.
+        """
+
+        assert (
+            result_dict.keys() == gt_dict.keys()
+        ), "Result and ground truth must contain the same number of frames."
+
+        counts = []
+
+        for fid in result_dict.keys():
+            result = result_dict[fid]
+            gt = gt_dict[fid]
+
+            result = self.filter_result(result, args, False)
+            gt = self.filter_result(gt, args, True)
+
+            result = result["instances"]
+            gt = gt["instances"]
+
+            IoU = class_aware_iou(result, gt)
+
+            # the number of ground truth boxes covered by a result box.
+            tp = int((IoU > args.iou_threshold).any(dim=0).sum())
+            counts.append((tp, len(result), len(gt)))
+
+        return summarize_detection(counts)
+
+    def of_interest(self, scores, class_ids):
+        """
+            The mask of filter_result without the confidence check, on
+            tensors of any shape.
+        """
+        wanted = torch.tensor(self.class_ids, device=class_ids.device)
+        return (scores < 0) | (class_ids[..., None] == wanted).any(dim=-1)
+
+    def select(self, scores, class_ids, confidence_threshold):
+        """
+            The mask of filter_result, on tensors of any shape.
+        """
+        return self.of_interest(scores, class_ids) & (
+            scores > confidence_threshold
+        )
+
+    def calc_accuracy_detection_video(
+        self, result_dict, gt_dict, args, frames_per_batch=1000
+    ):
+        """
+            Match the boxes of frames_per_batch frames at a time, as padded
+            [frames, boxes] tensors. The memory is proportional to
+            frames_per_batch times the product of the largest numbers of
+            result and ground truth boxes in a frame.
+        """
+
+        assert (
+            result_dict.keys() == gt_dict.keys()
+        ), "Result and ground truth must contain the same number of frames."
+
+        fids = list(result_dict.keys())
+        counts = []
+
+        for st in range(0, len(fids), frames_per_batch):
+            batch = fids[st : st + frames_per_batch]
+
+            boxes, scores, class_ids, valid = pack_results(result_dict, batch)
+            gt_boxes, gt_scores, gt_class_ids, gt_valid = pack_results(
+                gt_dict, batch
+            )
+
+            keep = valid & self.select(
+                scores, class_ids, args.confidence_threshold
+            )
+            gt_keep = gt_valid & self.select(
+                gt_scores, gt_class_ids, args.gt_confidence_threshold
+            )
+
+            match = batched_pairwise_iou(boxes, gt_boxes) > args.iou_threshold
+            match &= class_ids[:, :, None] == gt_class_ids[:, None, :]
+            match &= keep[:, :, None] & gt_keep[:, None, :]
+
+            tps = match.any(dim=1).sum(dim=1)
+            counts += zip(
+                tps.tolist(),
+                keep.sum(dim=1).tolist(),
+                gt_keep.sum(dim=1).tolist(),
+            )
+
+        return summarize_detection(counts)
+
+    def calc_accuracy_detection_sweep(
+        self,
+        result_dict,
+        gt_dict,
+        args,
+        confidence_thresholds,
+        gt_confidence_thresholds,
+        frames_per_batch=1000,
+    ):
+        """
+            calc_accuracy_detection_video for many thresholds, from one
+            matching pass. Boxes are matched regardless of their scores, and
+            each ground truth box keeps the highest score of the result boxes
+            covering it. It is a true positive under confidence threshold c
+            iff that score is above c. Sorting these scores, and the scores
+            of the result boxes, once per frame turns the counts under all
+            thresholds into a binary search.
+        """
+
+        assert (
+            result_dict.keys() == gt_dict.keys()
+        ), "Result and ground truth must contain the same number of frames."
+
+        confidence_thresholds = sorted(set(confidence_thresholds))
+        gt_confidence_thresholds = sorted(set(gt_confidence_thresholds))
+        fids = list(result_dict.keys())
+        counts = {
+            (conf, gt_conf): []
+            for conf in confidence_thresholds
+            for gt_conf in gt_confidence_thresholds
+        }
+
+        for st in range(0, len(fids), frames_per_batch):
+            batch = fids[st : st + frames_per_batch]
+
+            boxes, scores, class_ids, valid = pack_results(result_dict, batch)
+            gt_boxes, gt_scores, gt_class_ids, gt_valid = pack_results(
+                gt_dict, batch
+            )
+
+            keep = valid & self.of_interest(scores, class_ids)
+            gt_keep = gt_valid & self.of_interest(gt_scores, gt_class_ids)
+
+            match = batched_pairwise_iou(boxes, gt_boxes) > args.iou_threshold
+            match &= class_ids[:, :, None] == gt_class_ids[:, None, :]
+            match &= keep[:, :, None]
+
+            lowest = scores.new_tensor(float("-inf"))
+            covering = torch.where(match, scores[:, :, None], lowest)
+            covering = covering.max(dim=1).values
+
+            # compare in the dtype of the scores, as filter_result does.
+            thresholds = scores.new_tensor(confidence_thresholds)
+            thresholds = thresholds.expand(len(batch), -1).contiguous()
+
+            def num_above(values):
+                values = values.sort(dim=1).values
+                below = torch.searchsorted(values, thresholds, right=True)
+                return values.shape[1] - below
+
+            num_results = num_above(torch.where(keep, scores, lowest))
+
+            for gt_conf in gt_confidence_thresholds:
+                gt_kept = gt_keep & (gt_scores > gt_conf)
+                tps = num_above(torch.where(gt_kept, covering, lowest))
+                num_gts = gt_kept.sum(dim=1).tolist()
+                for i, conf in enumerate(confidence_thresholds):
+                    counts[conf, gt_conf] += zip(
+                        tps[:, i].tolist(),
+                        num_results[:, i].tolist(),
+                        num_gts,
+                    )
+
+        return {key: summarize_detection(counts[key]) for key in counts}
+
+    def calc_accuracy_keypoint(self, result_dict, gt_dict, args):
+        f1s = []
+        # prs = []
+        # res = []
+        # tps = []
+        # fps = []
+        # fns = []
+        for fid in result_dict.keys():
+            result = result_dict[fid]["instances"].get_fields()
+            gt = gt_dict[fid]["instances"].get_fields()
+            if len(gt["scores"]) == 0 and len(result["scores"]) == 0:
+                # prs.append(0.0)
+                # res.append(0.0)
+                f1s.append(1.0)
+                # tps.append(0.0)
+                # fps.append(0.0)
+                # fns.append(0.0)
+            elif len(result["scores"]) == 0 or len(gt["scores"]) == 0:
+                # prs.append(0.0)
+                # res.append(0.0)
+                f1s.append(0.0)
+                # tps.append(0.0)
+                # fps.append(0.0)
+                # fns.append(0.0)
+            else:
+                video_ind_res = result["scores"] == torch.max(result["scores"])
+                kpts_res = result["pred_keypoints"][video_ind_res]
+                video_ind_gt = gt["scores"] == torch.max(gt["scores"])
+                kpts_gt = gt["pred_keypoints"][video_ind_gt]
+
+                try:
+                    acc = kpts_res - kpts_gt
+                except:
+                    import pdb
+
+                    pdb.set_trace()
+                    print("shouldnt happen")
+
+                gt_boxes = gt["pred_boxes"][video_ind_gt].tensor
+                kpt_thresh = float(args.dist_thresh)
+
+                acc = acc[0]
+                acc = torch.sqrt(acc[:, 0] ** 2 + acc[:, 1] ** 2)
+                # acc[acc < kpt_thresh * kpt_thresh] = 0
+                for i in range(len(acc)):
+                    max_dim = max(
+                        (gt_boxes[i // 17][2] - gt_boxes[i // 17][0]),
+                        (gt_boxes[i // 17][3] - gt_boxes[i // 17][1]),
+                    )
+                    if acc[i] < (max_dim * kpt_thresh) ** 2:
+                        acc[i] = 0
+
+                accuracy = 1 - (len(acc.nonzero()) / acc.numel())
+                # prs.append(0.0)
+                # res.append(0.0)
+                f1s.append(accuracy)
+                # tps.append(0.0)
+                # fps.append(0.0)
+                # fns.append(0.0)
+
+        return {
+            "f1": torch.tensor(f1s).mean().item(),
+            # "pr": torch.tensor(prs).mean().item(),
+            # "re": torch.tensor(res).mean().item(),
+            # "tp": torch.tensor(tps).sum().item(),
+            # "fp": torch.tensor(fps).sum().item(),
+            # "fn": torch.tensor(fns).sum().item(),
+            # "f1s": f1s,
+            # "prs": prs,
+            # "res": res,
+            # "tps": tps,
+            # "fns": fns,
+            # "fps": fps,
+        }
+
+    # def calc_accuracy_loss_detection(self, result, gt, args):
+    #     # from detectron2.structures.boxes import pairwise_iou
+
+    #     gt = self.filter_result(gt, args, True)
+    #     result = self.filter_result(result, args, False, confidence_check=False)
+
+    #     result = result["instances"]
+    #     gt = gt["instances"].to("cuda")
+
+    #     if len(result) == 0 or len(gt) == 0:
+    #         if len(result) == 0 and len(gt) == 0:
+    #             return torch.tensor(1)
+    #         else:
+    #             return torch.tensor(0)
+
+    #     IoU = pairwise_iou(result.pred_boxes, gt.pred_boxes)
+
+    #     for i in range(len(result)):
+    #         for j in range(len(gt)):
+    #             if result.pred_classes[i] != gt.pred_classes[j]:
+    #                 IoU[i, j] = 0
+
+    #     tp = 0
+
+    #     def f(x):
+    #         a = args.alpha
+    #         x = x - args.confidence_threshold
+    #         # x == -a: 0, x == a: 1
+    #         res = (x + a) / (2 * a)
+    #         res = max(res, 0)
+    #         res = min(res, 1)
+    #         return res
+
+    #     for j in range(len(gt)):
+    #         tp_delta = 0
+    #         for i in range(len(result)):
+    #             if IoU[i, j] > args.iou_threshold:
+    #                 # IoU threshold will be hard threshold
+    #                 tp_delta += max(tp_delta, f(result.scores[i]))
+    #         tp = tp + tp_delta
+
+    #     fn = len(gt) - tp
+    #     fp = sum([f(result.scores[i]) for i in range(len(result))]) - tp
+    #     fp = max(fp, 0)
+
+    #     return -2 * tp / (2 * tp + fp + fn)
+
+    def get_undetected_ground_truth_index(self, result, gt, args):
+
+        if self.type == "Segmentation":
+            raise NotImplementedError
+
+        gt = deepcopy(gt)
+        result = deepcopy(result)
+
+        gt = self.filter_result(gt, args, gt=True)
+        result = self.filter_result(result, args, gt=False)
+
+        result = result["instances"]
+        gt = gt["instances"]
+
+        IoU = class_aware_iou(result, gt)
+
+        return (
+            (IoU > args.iou_threshold).sum(dim=0) == 0,
+            (IoU > args.iou_threshold).sum(dim=1) == 0,
+            gt,
+            result,
+        )
@@ -16,6 +16,7 @@ from detectron2.utils.events import EventStorage
 from detectron2.utils.visualizer import Visualizer
 from PIL import Image
 
+from .accuracy import coco_class_ids
 from .dnn import DNN
 
 panoptic_segmentation_labels = [
@@ -97,7 +98,7 @@ class COCO_Model(DNN):
         self.logger = logging.getLogger(self.name)
         handler = logging.NullHandler()
         self.logger.addHandler(handler)
-        self.class_ids = [0, 1, 2, 3, 5, 6, 7]
+        self.class_ids = coco_class_ids
 
         if "Detection" in self.name:
             self.type = "Detection"
@@ -127,9 +128,9 @@ class COCO_Model(DNN):
 
     def preprocess_image(self, image):
 
-        assert (
-            len(image.shape) == 4 and image.shape[0] == 1
-        ), "Only deal with one image to avoid GPU memory overflow."
+        # frames of a batch share their size, and thus their transform.
+        # Use micro batches in inference_batch to avoid GPU memory overflow.
+        assert len(image.shape) == 4, "Expect [N, 3, H, W] images."
 
         h, w = image.shape[2], image.shape[3]
 
@@ -164,6 +165,37 @@ class COCO_Model(DNN):
                 ret[key] = ret[key].to("cpu")
         return ret
 
+    def inference_batch(
+        self, images, detach=False, grad=False, micro_batch_size=None
+    ):
+        """
+            Run the model on [N, 3, H, W] images and return the result of each
+            frame. Frames go through the model micro_batch_size at a time
+            (default: all at once) to cap the memory.
+        """
+
+        if self.predictor is None:
+            self.predictor = DefaultPredictor(self.cfg)
+
+        self.predictor.model.eval()
+
+        rets = []
+        for batch in images.split(micro_batch_size or len(images)):
+
+            batch, h, w, _ = self.preprocess_image(batch)
+
+            with torch.enable_grad() if grad else torch.no_grad():
+                inputs = [
+                    {"image": image, "height": h, "width": w} for image in batch
+                ]
+                rets += self.predictor.model(inputs)
+
+        if detach:
+            for ret in rets:
+                for key in ret:
+                    ret[key] = ret[key].to("cpu")
+        return rets
+
     def region_proposal(self, image, detach=False, grad=False):
 
         if self.predictor is None:
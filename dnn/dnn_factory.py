@@ -1,38 +1,71 @@
 """
     The factory to build DNN according to 1). the name or 2). the yml file
+    Model modules are only imported when a model is first built, since some
+    of them pull in heavy dependencies (detectron2, torch hub).
 """
 
-from dnn.efficient_det.interface import EfficientDet
+import importlib
 
-from .coco_model import COCO_Model
-from .efficient_det.interface import EfficientDet
-from .fasterrcnn_resnet50 import FasterRCNN_ResNet50_FPN
-from .fcn_resnet50 import FCN_ResNet50
-from .mobilenet import SSD
+from .accuracy import Accuracy, get_spec
 
 # from .detr_resnet101 import Detr_ResNet101
-from .segmentation import Segmentation
-from .yolo5 import Yolo5s
+
+
+def load_class(module, name):
+    return getattr(importlib.import_module(module, __package__), name)
 
 
 class DNN_Factory:
+
+    # models built so far, shared by all factories once keep_models() is
+    # called, so that a long-lived process builds each model only once.
+    models = None
+
+    @classmethod
+    def keep_models(cls):
+        if cls.models is None:
+            cls.models = {}
+
     def __init__(self):
+        # name: (module, class)
         self.name2model = {
-            "FasterRCNN_ResNet50_FPN": FasterRCNN_ResNet50_FPN,
-            "EfficientDet": EfficientDet,
-            "MobileNet-SSD": SSD,
-            # "Detr_ResNet101": Detr_ResNet101,
-            "Yolo5s": Yolo5s,
+            "FasterRCNN_ResNet50_FPN": (
+                ".fasterrcnn_resnet50",
+                "FasterRCNN_ResNet50_FPN",
+            ),
+            "EfficientDet": (".efficient_det.interface", "EfficientDet"),
+            "MobileNet-SSD": (".mobilenet", "SSD"),
+            # "Detr_ResNet101": (".detr_resnet101", "Detr_ResNet101"),
+            "Yolo5s": (".yolo5", "Yolo5s"),
         }
 
     def get_model(self, name):
 
+        if DNN_Factory.models is None:
+            return self.build_model(name)
+        if name not in DNN_Factory.models:
+            DNN_Factory.models[name] = self.build_model(name)
+        return DNN_Factory.models[name]
+
+    def build_model(self, name):
+
         if name in self.name2model:
-            return self.name2model[name]()
+            return load_class(*self.name2model[name])()
         elif "Segmentation" in name:
-            return Segmentation(name)
+            return load_class(".segmentation", "Segmentation")(name)
         elif name == "fcn_resnet50":
-            return FCN_ResNet50()
+            return load_class(".fcn_resnet50", "FCN_ResNet50")()
         else:
             assert "yaml" in name
-            return COCO_Model(name)
+            return load_class(".coco_model", "COCO_Model")(name)
+
+    def get_accuracy(self, name):
+        """
+            Return an object with the name and the accuracy computation of a
+            model. The model is only built for models with their own accuracy
+            computation.
+        """
+
+        if get_spec(name) is not None:
+            return Accuracy(name)
+        return self.get_model(name)
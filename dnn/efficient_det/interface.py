@@ -18,6 +18,7 @@ from detectron2.data import DatasetCatalog, MetadataCatalog
 from detectron2.structures.boxes import Boxes, pairwise_iou
 from detectron2.structures.instances import Instances
 from detectron2.utils.visualizer import Visualizer
+from dnn.accuracy import specs
 from dnn.dnn import DNN
 from dnn.efficient_det.backbone import EfficientDetBackbone
 from dnn.efficient_det.efficientdet.utils import BBoxTransform, ClipBoxes
@@ -152,7 +153,7 @@ class EfficientDet(DNN):
         self.model.cuda()
 
         # class ids: all vehicles and persons except for train.
-        self.class_ids = [0, 1, 2, 3, 4, 6]
+        self.class_ids = specs["EfficientDet"][1]
         # code refactor version
         # self.model = EfficientDetBackbone(compound_coef=compound_coef, num_classes=len(obj_list))
         # self.model.load_state_dict(torch.load(f'dnn/efficient_det/weights/efficientdet-d{compound_coef}.pth'))
@@ -9,6 +9,7 @@ from detectron2.structures.instances import Instances
 from detectron2.utils.visualizer import Visualizer
 from PIL import Image
 
+from .accuracy import specs
 from .dnn import DNN
 
 
@@ -28,7 +29,7 @@ class SSD(DNN):
         self.model.eval()
 
         self.logger = logging.getLogger(self.name)
-        self.class_ids = [0, 1, 2, 3, 5, 6, 7]
+        self.class_ids = specs["MobileNet-SSD"][1]
 
     def inference(self, image, detach=False, grad=False):
 
@@ -8,6 +8,7 @@ from detectron2.structures.boxes import Boxes
 from detectron2.structures.instances import Instances
 from utilities.bbox_utils import *
 
+from .accuracy import specs
 from .dnn import DNN
 
 
@@ -23,7 +24,7 @@ class Yolo5s(DNN):
         self.logger = logging.getLogger(self.name)
         handler = logging.NullHandler()
         self.logger.addHandler(handler)
-        self.class_ids = [1, 2, 3, 4, 6, 7, 8]
+        self.class_ids = specs["Yolo5s"][1]
 
         self.is_cuda = False
 
@@ -1,5 +1,6 @@
 import argparse
 import logging
+import multiprocessing as mp
 import pickle
 from pathlib import Path
 from pdb import set_trace
@@ -17,42 +18,119 @@ from utilities.results_utils import read_results, write_results
 from utilities.video_utils import read_bandwidth
 
 
-def main(args):
+def select_frames(results, args):
+    """
+        Only keep frames [args.start, args.end). Frame ids are absolute.
+        Unbounded results are returned as they are, so that columnar results
+        stay lazy.
+    """
+    if args.start == 0 and args.end is None:
+        return results
+    end = float("inf") if args.end is None else args.end
+    return {fid: results[fid] for fid in results if args.start <= fid < end}
 
-    logger = logging.getLogger("examine")
-    handler = logging.NullHandler()
-    logger.addHandler(handler)
 
-    bws = [read_bandwidth(video) for video in args.inputs]
-    video_names = args.inputs
+def examine_video(video_name, bw, app, ground_truth_dict, args):
+    """
+        Return the stats rows of one video.
+    """
 
-    app = DNN_Factory().get_model(args.app)
+    logger = logging.getLogger("examine")
 
-    ground_truth_dict = read_results(args.ground_truth, app.name, logger)
+    # a sweep matches the boxes once for all pairs of thresholds.
+    sweep = (
+        args.confidence_thresholds is not None
+        or args.gt_confidence_thresholds is not None
+    )
+
+    video_dict = read_results(video_name, app.name, logger)
+    video_dict = select_frames(video_dict, args)
+    if sweep:
+        sweep_metrics = app.calc_accuracy_sweep(
+            video_dict,
+            ground_truth_dict,
+            args,
+            args.confidence_thresholds or [args.confidence_threshold],
+            args.gt_confidence_thresholds or [args.gt_confidence_threshold],
+        )
+    else:
+        sweep_metrics = {
+            (
+                args.confidence_threshold,
+                args.gt_confidence_threshold,
+            ): app.calc_accuracy(video_dict, ground_truth_dict, args)
+        }
 
-    for video_name, bw in zip(video_names, bws):
-        video_dict = read_results(video_name, app.name, logger)
-        metrics = app.calc_accuracy(video_dict, ground_truth_dict, args)
+    stats = []
+    for (conf, gt_conf), metrics in sweep_metrics.items():
         res = {
             "application": app.name,
             "video_name": video_name,
             "bw": bw,
             "ground_truth_name": args.ground_truth,
-            "gt_conf": float(args.gt_confidence_threshold),
-            "conf": float(args.confidence_threshold),
+            "gt_conf": float(gt_conf),
+            "conf": float(conf),
         }
         res.update(metrics)
-        with open(args.stats, "a") as f:
-            f.write(yaml.dump([res]))
+        stats.append(res)
+    return stats
 
 
-if __name__ == "__main__":
+# the app, ground truth and args of a worker process.
+worker_state = {}
 
-    # set the format of the logger
-    coloredlogs.install(
-        fmt="%(asctime)s [%(levelname)s] %(name)s:%(funcName)s[%(lineno)s] -- %(message)s",
-        level="INFO",
+
+def init_worker(app, ground_truth_dict, args):
+
+    # workers are forked, so they inherit the ground truth loaded by the
+    # parent. Its tensors are shared copy-on-write, and never written.
+    worker_state.update(
+        app=app, ground_truth_dict=ground_truth_dict, args=args
     )
+    # one thread per worker, as the workers already occupy the cores.
+    torch.set_num_threads(1)
+
+
+def examine_in_worker(video_name, bw):
+    return examine_video(video_name, bw, **worker_state)
+
+
+def main(args):
+
+    logger = logging.getLogger("examine")
+    handler = logging.NullHandler()
+    logger.addHandler(handler)
+
+    bws = [read_bandwidth(video) for video in args.inputs]
+    video_names = args.inputs
+
+    app = DNN_Factory().get_accuracy(args.app)
+
+    ground_truth_dict = read_results(args.ground_truth, app.name, logger)
+    ground_truth_dict = select_frames(ground_truth_dict, args)
+
+    num_workers = min(args.num_workers, len(video_names))
+    if num_workers > 1:
+        context = mp.get_context("fork")
+        with context.Pool(
+            num_workers, init_worker, (app, ground_truth_dict, args)
+        ) as pool:
+            video_stats = pool.starmap(
+                examine_in_worker, zip(video_names, bws)
+            )
+    else:
+        video_stats = [
+            examine_video(video_name, bw, app, ground_truth_dict, args)
+            for video_name, bw in zip(video_names, bws)
+        ]
+
+    # one write for all videos, in the order of the inputs.
+    stats = [res for video_stat in video_stats for res in video_stat]
+    with open(args.stats, "a") as f:
+        f.write(yaml.dump(stats))
+
+
+def get_parser():
 
     parser = argparse.ArgumentParser()
 
@@ -88,13 +166,44 @@ if __name__ == "__main__":
         help="The confidence score threshold for calculating accuracy.",
         default=0.7,
     )
+    parser.add_argument(
+        "--confidence_thresholds",
+        type=float,
+        help="Sweep these confidence score thresholds in one pass, "
+        "instead of using --confidence_threshold.",
+        nargs="+",
+        default=None,
+    )
+    parser.add_argument(
+        "--gt_confidence_thresholds",
+        type=float,
+        help="Sweep these ground-truth confidence score thresholds in one "
+        "pass, instead of using --gt_confidence_threshold.",
+        nargs="+",
+        default=None,
+    )
     parser.add_argument(
         "--iou_threshold",
         type=float,
         help="The IoU threshold for calculating accuracy in object detection.",
         default=0.5,
     )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        help="The number of videos to examine concurrently.",
+        default=1,
+    )
     parser.add_argument("--size_bound", type=float, default=0.05)
+    parser.add_argument(
+        "--start", type=int, help="The first frame to examine.", default=0,
+    )
+    parser.add_argument(
+        "--end",
+        type=int,
+        help="Examine frames before this one. Defaults to the whole video.",
+        default=None,
+    )
     parser.add_argument(
         "--dist_thresh",
         type=float,
@@ -102,6 +211,17 @@ if __name__ == "__main__":
         default=3,
     )
 
-    args = parser.parse_args()
+    return parser
+
+
+if __name__ == "__main__":
+
+    # set the format of the logger
+    coloredlogs.install(
+        fmt="%(asctime)s [%(levelname)s] %(name)s:%(funcName)s[%(lineno)s] -- %(message)s",
+        level="INFO",
+    )
+
+    args = get_parser().parse_args()
 
     main(args)
@@ -18,9 +18,9 @@ from torchvision import io
 from dnn.CARN.interface import CARN
 from dnn.dnn_factory import DNN_Factory
 from utilities.mask_utils import merge_black_bkgd_images
-from utilities.results_utils import read_results, write_results
+from utilities.results_utils import ResultsWriter, read_results, shard_name
 from utilities.timer import Timer
-from utilities.video_utils import read_videos
+from utilities.video_utils import read_videos, unbatch
 
 # from dnn.fasterrcnn_resnet50 import FasterRCNN_ResNet50_FPN
 
@@ -31,14 +31,44 @@ from utilities.video_utils import read_videos
 
 def main(args):
 
+    # the worker runs many jobs in one process, so close the writer's thread
+    # and event file after each.
+    with SummaryWriter(f"runs/{args.app}/{args.input}") as writer:
+        infer(args, writer)
+
+
+def infer(args, writer):
+
     logger = logging.getLogger("inference")
     handler = logging.NullHandler()
     logger.addHandler(handler)
 
+    app = DNN_Factory().get_model(args.app)
+
+    # results are appended every --flush_every frames, and a run resumes
+    # after the frames that a crashed run already wrote.
+    results_writer = ResultsWriter(
+        shard_name(args.input, args.start, args.end),
+        app.name,
+        logger,
+        args.flush_every,
+    )
+    start = args.start
+    if results_writer.next_fid is not None:
+        start = max(start, results_writer.next_fid)
+
     if "dual" not in args.input:
         assert args.from_source == False
         videos, _, _ = read_videos(
-            [args.input], logger, normalize=False, from_source=args.from_source
+            [args.input],
+            logger,
+            normalize=False,
+            from_source=args.from_source,
+            # uint8 batches, converted to float on the gpu.
+            batch_size=args.batch_size,
+            device="cuda",
+            start=start,
+            end=args.end,
         )
     else:
         # set_trace()
@@ -50,16 +80,18 @@ def main(args):
         # assert "mp4" in video_names[1]
 
         videos, _, _ = read_videos(
-            video_names, logger, normalize=False, from_source=args.from_source,
+            video_names,
+            logger,
+            normalize=False,
+            from_source=args.from_source,
+            batch_size=args.batch_size,
+            start=start,
+            end=args.end,
         )
 
         with open(video_names[1] + ".mask", "rb") as f:
             mask = pickle.load(f)
 
-    # Construct image writer for visualization purpose
-    writer = SummaryWriter(f"runs/{args.app}/{args.input}")
-
-    app = DNN_Factory().get_model(args.app)
     if args.enable_cloudseg:
         super_resoluter = CARN()
 
@@ -81,9 +113,28 @@ def main(args):
     progress_bar = enlighten.get_manager().counter(
         total=len(videos[0]), desc=f"{app.name}: {args.input}", unit="frames",
     )
+    # the results of the last batch, for visualization.
     inference_results = {}
 
-    for fid, video_slice in enumerate(zip(*videos)):
+    # frames waiting for the model, as (frame id, frame).
+    pending = []
+
+    def flush():
+        if pending:
+            images = torch.cat([image for _, image in pending])
+            results = app.inference_batch(
+                images, detach=True, micro_batch_size=args.batch_size
+            )
+            inference_results.clear()
+            for (fid, _), result in zip(pending, results):
+                inference_results[fid] = result
+                results_writer.write(fid, result)
+            pending.clear()
+
+    # frame ids are absolute, so that the results of shards can be merged.
+    for fid, video_slice in enumerate(
+        zip(*[unbatch(video) for video in videos]), start=start
+    ):
 
         if "dual" in args.input:
             hq_video_slice = video_slice[1]
@@ -107,9 +158,15 @@ def main(args):
         # video_slice = video_slice + torch.randn_like(video_slice) * 0.05
         # with Timer("inference", logger):
         video_slice = video_slice.cuda()
-        inference_results[fid] = app.inference(video_slice, detach=True)
+        pending.append((fid, video_slice))
+
+        # visualized frames need their results right away.
+        step = fid % args.visualize_step_size
+        visualized = args.visualize and step in [0, 1, 2]
+        if len(pending) == args.batch_size or visualized:
+            flush()
 
-        if args.visualize and fid % args.visualize_step_size in [0, 1, 2]:
+        if visualized:
             image = T.ToPILImage()(
                 F.interpolate(video_slice, (720, 1280))[0].cpu()
             )
@@ -181,16 +238,13 @@ def main(args):
                     fid,
                 )
 
-    write_results(args.input, app.name, inference_results, logger)
+    # the last partial batch. The number of frames in the container metadata
+    # may be off, so it cannot tell which frame is the last one.
+    flush()
+    results_writer.close()
 
 
-if __name__ == "__main__":
-
-    # set the format of the logger
-    coloredlogs.install(
-        fmt="%(asctime)s [%(levelname)s] %(name)s:%(funcName)s[%(lineno)s] -- %(message)s",
-        level="INFO",
-    )
+def get_parser():
 
     parser = argparse.ArgumentParser()
 
@@ -256,8 +310,39 @@ if __name__ == "__main__":
     parser.add_argument(
         "--tile_size", type=int, help="The tile size.", default=16,
     )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        help="The number of frames the model processes at once.",
+        default=1,
+    )
+    parser.add_argument(
+        "--flush_every",
+        type=int,
+        help="Append the results to disk every this many frames.",
+        default=100,
+    )
+    parser.add_argument(
+        "--start", type=int, help="The first frame to process.", default=0,
+    )
+    parser.add_argument(
+        "--end",
+        type=int,
+        help="Process frames before this one. Defaults to the whole video.",
+        default=None,
+    )
 
-    args = parser.parse_args()
+    return parser
 
-    main(args)
 
+if __name__ == "__main__":
+
+    # set the format of the logger
+    coloredlogs.install(
+        fmt="%(asctime)s [%(levelname)s] %(name)s:%(funcName)s[%(lineno)s] -- %(message)s",
+        level="INFO",
+    )
+
+    args = get_parser().parse_args()
+
+    main(args)
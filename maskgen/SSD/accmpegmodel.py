@@ -632,6 +632,9 @@ class FCN(nn.Module):
             nn.BatchNorm2d(2),
         )
 
+        # not a parameter, so that checkpoints load unchanged.
+        self.lean_head = True
+
     """
         Deprecated forwarding code that generates heats based on feature rather than the confidence.
     """
@@ -740,6 +743,11 @@ class FCN(nn.Module):
                 header_index += 1
                 confidences.append(confidence)
 
+        if self.lean_head and not self.training:
+            return self.lean_process(confidences + fpn)
+
+        with torch.no_grad():
+
             confidences = [F.interpolate(i, (45, 80)) for i in confidences]
             confidences = torch.cat(confidences, 1)
             fpn = [F.interpolate(i, (45, 80)) for i in fpn]
@@ -760,6 +768,41 @@ class FCN(nn.Module):
 
         return self.process(confidences)
 
+    def lean_process(self, features):
+        """
+            Same as self.process on the concatenation of the features
+            interpolated to 45x80, in eval mode, without materializing the
+            3700-channel concatenation.
+            The first batchnorm is folded into the first conv, and a conv over
+            a concatenation is the sum of the convs over its parts.
+        """
+
+        bn, conv = self.process[0], self.process[1]
+        scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+        shift = bn.bias - bn.running_mean * scale
+        weight = conv.weight * scale[None, :, None, None]
+
+        out = None
+        start = 0
+        for feature in features:
+            end = start + feature.shape[1]
+            feature = F.interpolate(feature, (45, 80))
+            partial = F.conv2d(
+                feature, weight[:, start:end], padding=conv.padding
+            )
+            out = partial if out is None else out.add_(partial)
+            start = end
+        assert start == conv.in_channels
+
+        # the zero padding is applied after the batchnorm, so the shift does
+        # not reach the taps that fall outside the frame.
+        shift = (conv.weight * shift[None, :, None, None]).sum(1, keepdim=True)
+        out += F.conv2d(
+            out.new_ones(1, 1, 45, 80), shift, conv.bias, padding=conv.padding
+        )
+
+        return self.process[2:](out)
+
     def save(self, path):
         torch.save(self.state_dict(), path)
 
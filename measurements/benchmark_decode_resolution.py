@@ -0,0 +1,107 @@
+"""
+    Measure the latency and the accuracy of the mask generator when the frames
+    are decoded at a lower resolution. Accuracy is the IoU between the
+    binarized mask and the one obtained from full-resolution frames.
+    Run from the repository root:
+    python -m measurements.benchmark_decode_resolution -i videos/dashcamcropped_1_qp_30.mp4 \
+        --maskgen_file maskgen/SSD/accmpegmodel.py -p maskgen_pths/xxx.pth.best \
+        --sizes 360 640 180 320
+"""
+
+import argparse
+import logging
+import time
+
+import coloredlogs
+import torch
+
+from utilities.maskgen_utils import load_mask_generator
+from utilities.video_utils import VideoStream, no_postprocess
+
+
+def run(mask_generator, args, logger, size):
+
+    video = VideoStream(
+        args.input, no_postprocess, logger, end=args.num_frames, size=size
+    )
+    device = next(mask_generator.parameters()).device
+
+    decode_time = 0
+    maskgen_time = 0
+    heats = []
+
+    tstart = time.time()
+    for image in video:
+        decode_time += time.time() - tstart
+
+        tstart = time.time()
+        with torch.no_grad():
+            heat = mask_generator(image[None, :, :, :].to(device))
+            heats.append(heat.softmax(dim=1)[:, 1:2, :, :].cpu())
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        maskgen_time += time.time() - tstart
+
+        tstart = time.time()
+
+    return (
+        decode_time / len(heats),
+        maskgen_time / len(heats),
+        (torch.cat(heats) > args.bound),
+    )
+
+
+def main(args):
+
+    logger = logging.getLogger("benchmark_decode_resolution")
+
+    mask_generator = load_mask_generator(args.maskgen_file, args.path)
+    mask_generator.eval()
+    if torch.cuda.is_available():
+        mask_generator.cuda()
+
+    sizes = [None] + [
+        (args.sizes[i], args.sizes[i + 1]) for i in range(0, len(args.sizes), 2)
+    ]
+
+    full_mask = None
+    for size in sizes:
+        decode, maskgen, mask = run(mask_generator, args, logger, size)
+        if full_mask is None:
+            full_mask = mask
+        iou = (mask & full_mask).sum().item() / max(
+            (mask | full_mask).sum().item(), 1
+        )
+        logger.info(
+            "size %s: decode %.4f sec/frame, maskgen %.4f sec/frame, IoU %.3f",
+            "full" if size is None else "%dx%d" % size,
+            decode,
+            maskgen,
+            iou,
+        )
+
+
+if __name__ == "__main__":
+
+    coloredlogs.install(
+        fmt="%(asctime)s [%(levelname)s] %(name)s:%(funcName)s[%(lineno)s] -- %(message)s",
+        level="INFO",
+    )
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", type=str, required=True)
+    parser.add_argument("--maskgen_file", type=str, required=True)
+    parser.add_argument("-p", "--path", type=str, required=True)
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        help="Pairs of height and width to compare against full resolution.",
+        default=[360, 640],
+    )
+    parser.add_argument("--num_frames", type=int, default=200)
+    parser.add_argument("--bound", type=float, default=0.2)
+
+    args = parser.parse_args()
+
+    main(args)
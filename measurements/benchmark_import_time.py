@@ -0,0 +1,74 @@
+"""
+    Measure the time to import each entry point, in a fresh interpreter, and
+    the time examine.py takes to get the accuracy computation of an app.
+    The startup time of a bare interpreter is subtracted.
+    Run from the repository root:
+    python -m measurements.benchmark_import_time --app COCO-Detection/faster_rcnn_R_101_FPN_3x.yaml
+"""
+
+import argparse
+import logging
+import subprocess
+import sys
+import time
+
+import coloredlogs
+
+entry_points = [
+    "dnn.dnn_factory",
+    "examine",
+    "inference",
+    "compress_blackgen_roi",
+    "worker",
+]
+
+
+def timeit(code, num_runs):
+    elapsed = []
+    for _ in range(num_runs):
+        tstart = time.time()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        elapsed.append(time.time() - tstart)
+    return min(elapsed)
+
+
+def main(args):
+
+    logger = logging.getLogger("benchmark_import_time")
+
+    baseline = timeit("pass", args.num_runs)
+    logger.info("bare interpreter: %.3f sec", baseline)
+
+    for entry_point in entry_points:
+        elapsed = timeit(f"import {entry_point}", args.num_runs) - baseline
+        logger.info("import %s: %.3f sec", entry_point, elapsed)
+
+    elapsed = (
+        timeit(
+            "from dnn.dnn_factory import DNN_Factory;"
+            f"DNN_Factory().get_accuracy({args.app!r})",
+            args.num_runs,
+        )
+        - baseline
+    )
+    logger.info("accuracy of %s: %.3f sec", args.app, elapsed)
+
+
+if __name__ == "__main__":
+
+    coloredlogs.install(
+        fmt="%(asctime)s [%(levelname)s] %(name)s:%(funcName)s[%(lineno)s] -- %(message)s",
+        level="INFO",
+    )
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--app",
+        type=str,
+        default="COCO-Detection/faster_rcnn_R_101_FPN_3x.yaml",
+    )
+    parser.add_argument("--num_runs", type=int, default=3)
+
+    args = parser.parse_args()
+
+    main(args)
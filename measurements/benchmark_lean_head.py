@@ -0,0 +1,119 @@
+"""
+    Check that the lean head of maskgen/SSD/accmpegmodel.py (FCN.lean_process)
+    computes the same heat as the concatenation-based head, and compare their
+    latency and peak memory.
+    Run from the repository root:
+    python -m measurements.benchmark_lean_head \
+        --maskgen_file maskgen/SSD/accmpegmodel.py -p maskgen_pths/xxx.pth.best
+"""
+
+import argparse
+import logging
+import multiprocessing as mp
+import resource
+import time
+
+import coloredlogs
+import torch
+
+from utilities.maskgen_utils import load_mask_generator
+
+
+def build(args, lean_head):
+    mask_generator = load_mask_generator(args.maskgen_file, args.path)
+    mask_generator.eval()
+    mask_generator.lean_head = lean_head
+    return mask_generator.to(args.device)
+
+
+def inputs(args):
+    torch.manual_seed(0)
+    return torch.rand(args.batch_size, 3, 720, 1280).to(args.device)
+
+
+def check(args, logger):
+
+    x = inputs(args)
+    with torch.no_grad():
+        full = build(args, False)(x)
+        lean = build(args, True)(x)
+
+    error = (full - lean).abs().max().item()
+    logger.info("max abs difference of the logits: %.3g", error)
+    assert torch.allclose(full, lean, rtol=1e-4, atol=1e-4)
+
+    full, lean = full.softmax(dim=1), lean.softmax(dim=1)
+    same = ((full[:, 1] > args.bound) == (lean[:, 1] > args.bound)).all()
+    logger.info("identical masks at bound %.2f: %s", args.bound, same.item())
+
+
+def measure(args, lean_head, results):
+
+    mask_generator = build(args, lean_head)
+    x = inputs(args)
+    with torch.no_grad():
+        # warm up
+        mask_generator(x)
+        if args.device == "cuda":
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+
+        tstart = time.time()
+        for _ in range(args.num_runs):
+            mask_generator(x)
+        if args.device == "cuda":
+            torch.cuda.synchronize()
+        latency = (time.time() - tstart) / args.num_runs
+
+    if args.device == "cuda":
+        peak = torch.cuda.max_memory_allocated() / (1 << 20)
+    else:
+        # in kilobytes on linux. Each head runs in its own process, so that
+        # the peak of one does not hide the other.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1 << 10)
+    results[lean_head] = (latency, peak)
+
+
+def main(args):
+
+    logger = logging.getLogger("benchmark_lean_head")
+
+    check(args, logger)
+
+    results = mp.Manager().dict()
+    for lean_head in [False, True]:
+        process = mp.get_context("spawn").Process(
+            target=measure, args=(args, lean_head, results)
+        )
+        process.start()
+        process.join()
+
+    for lean_head, name in [(False, "concat"), (True, "lean")]:
+        latency, peak = results[lean_head]
+        logger.info(
+            "%s head: %.4f sec/batch, peak memory %.1f MB", name, latency, peak
+        )
+
+
+if __name__ == "__main__":
+
+    coloredlogs.install(
+        fmt="%(asctime)s [%(levelname)s] %(name)s:%(funcName)s[%(lineno)s] -- %(message)s",
+        level="INFO",
+    )
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--maskgen_file", type=str, required=True)
+    parser.add_argument("-p", "--path", type=str, required=True)
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--num_runs", type=int, default=10)
+    parser.add_argument("--bound", type=float, default=0.2)
+    parser.add_argument(
+        "--device",
+        type=str,
+        default="cuda" if torch.cuda.is_available() else "cpu",
+    )
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,80 @@
+"""
+    Measure the throughput of the mask generator against the batch size.
+    Per-call overhead (the python loop over the backbone layers and the
+    interpolation of every feature map) is paid once per batch, so larger
+    batches should process more frames per second until compute saturates.
+    Run from the repository root:
+    python -m measurements.benchmark_maskgen_batch \
+        --maskgen_file maskgen/SSD/accmpegmodel.py -p maskgen_pths/xxx.pth.best \
+        --batch_sizes 1 2 4 8 --backend onnx
+"""
+
+import argparse
+import logging
+import time
+
+import coloredlogs
+import torch
+
+from utilities.maskgen_utils import (
+    backends,
+    generate_heat,
+    load_mask_generator,
+)
+
+
+def main(args):
+
+    logger = logging.getLogger("benchmark_maskgen_batch")
+
+    mask_generator = load_mask_generator(
+        args.maskgen_file, args.path, args.backend
+    )
+    mask_generator.eval()
+    torch.set_num_threads(args.num_threads)
+
+    frames = [
+        torch.rand(1, 3, 720, 1280) for _ in range(max(args.batch_sizes))
+    ]
+
+    for batch_size in args.batch_sizes:
+        batch = frames[:batch_size]
+
+        # warm up, so that allocation is not measured.
+        generate_heat(mask_generator, batch)
+
+        tstart = time.time()
+        for _ in range(args.num_batches):
+            generate_heat(mask_generator, batch)
+        elapsed = time.time() - tstart
+
+        logger.info(
+            "%s, batch size %d: %.2f frames/sec",
+            args.backend,
+            batch_size,
+            batch_size * args.num_batches / elapsed,
+        )
+
+
+if __name__ == "__main__":
+
+    coloredlogs.install(
+        fmt="%(asctime)s [%(levelname)s] %(name)s:%(funcName)s[%(lineno)s] -- %(message)s",
+        level="INFO",
+    )
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--maskgen_file", type=str, required=True)
+    parser.add_argument("-p", "--path", type=str, required=True)
+    parser.add_argument(
+        "--batch_sizes", type=int, nargs="+", default=[1, 2, 4, 8]
+    )
+    parser.add_argument("--num_batches", type=int, default=5)
+    parser.add_argument(
+        "--backend", type=str, choices=backends, default="cpu"
+    )
+    parser.add_argument("--num_threads", type=int, default=4)
+
+    args = parser.parse_args()
+
+    main(args)
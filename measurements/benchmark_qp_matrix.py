@@ -0,0 +1,64 @@
+"""
+    Compare write_qp_matrix against the per-macroblock loop it replaced,
+    and check that both write the same bytes.
+    Run from the repository root: python -m measurements.benchmark_qp_matrix
+"""
+
+import filecmp
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+import coloredlogs
+import torch
+
+from utilities.compressor import write_qp_matrix
+
+
+def write_qp_matrix_loop(mask, filename):
+    with open(filename, "w") as qp_file:
+
+        for i in range(mask.shape[0]):
+            for j in range(mask.shape[1]):
+                for k in range(mask.shape[2]):
+                    qp_file.write(f"{mask[i,j,k]} ")
+                qp_file.write("\n")
+
+
+def main():
+
+    logger = logging.getLogger("benchmark_qp_matrix")
+
+    # 10-frame segment, tile 16 on 720p, same dtype as compress_blackgen_roi.
+    mask = (torch.rand(10, 1, 45, 80) > 0.5).int()
+    mask = torch.where(
+        mask == 1, 30 * torch.ones_like(mask), 40 * torch.ones_like(mask)
+    ).squeeze(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, writer in [
+            ("loop", write_qp_matrix_loop),
+            ("vectorized", write_qp_matrix),
+        ]:
+            tstart = time.time()
+            for _ in range(10):
+                writer(mask, Path(tmp) / name)
+            logger.info(
+                "%s: %.5f sec/segment", name, (time.time() - tstart) / 10
+            )
+
+        assert filecmp.cmp(
+            Path(tmp) / "loop", Path(tmp) / "vectorized", shallow=False
+        ), "The qp matrix files differ."
+        logger.info("Both writers produce identical files.")
+
+
+if __name__ == "__main__":
+
+    coloredlogs.install(
+        fmt="%(asctime)s [%(levelname)s] %(name)s:%(funcName)s[%(lineno)s] -- %(message)s",
+        level="INFO",
+    )
+
+    main()
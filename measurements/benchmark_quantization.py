@@ -0,0 +1,126 @@
+"""
+    Compare int8 mask generators against their fp32 versions on the cpu.
+    Latency is per frame. Agreement is the IoU between the final ROI masks
+    (thresholded at --bound and dilated by --conv_size, as in
+    compress_blackgen_roi.py) of the two models. The models are calibrated
+    on the first --calibration_frames frames and evaluated on the next ones.
+    Boundaries is the number of times activations are quantized, which
+    fusion keeps low. maskgen/mobilenet_v2.py cannot be traced as a whole,
+    so it exercises the per-module fallback.
+    Run from the repository root:
+    python -m measurements.benchmark_quantization -i videos/dashcamcropped_1_qp_30.mp4 \
+        --maskgen_files maskgen/SSD/accmpegmodel.py maskgen/fcn_16_single_channel.py \
+            maskgen/mobilenet_v2.py \
+        -p maskgen_pths/xxx.pth.best maskgen_pths/yyy.pth.best \
+            maskgen_pths/zzz.pth.best
+"""
+
+import argparse
+import logging
+import time
+
+import coloredlogs
+import torch
+from torch.fx import GraphModule
+
+from utilities.mask_utils import dilate_binarize
+from utilities.maskgen_utils import (
+    calibration_frames,
+    generate_heat,
+    load_mask_generator,
+)
+from utilities.video_utils import VideoStream, no_postprocess
+
+
+def run(mask_generator, frames, args):
+
+    masks = []
+    tstart = time.time()
+    for image in frames:
+        masks.append(generate_heat(mask_generator, [image]))
+    latency = (time.time() - tstart) / len(frames)
+
+    mask = (torch.cat(masks) > args.bound).float()
+    mask = dilate_binarize(mask, 0.5, args.conv_size, cuda=False)
+    return latency, mask > 0.5
+
+
+def count_boundaries(mask_generator):
+    """
+        The number of quantize nodes in the quantized modules of a generator.
+    """
+    return sum(
+        node.target == torch.quantize_per_tensor
+        for module in mask_generator.modules()
+        if isinstance(module, GraphModule)
+        for node in module.graph.nodes
+    )
+
+
+def main(args):
+
+    logger = logging.getLogger("benchmark_quantization")
+    torch.set_num_threads(args.num_threads)
+
+    calibration = calibration_frames(args.input, logger, args.calibration_frames)
+    video = VideoStream(
+        args.input,
+        no_postprocess,
+        logger,
+        start=args.calibration_frames,
+        end=args.calibration_frames + args.num_frames,
+    )
+    frames = [image[None, :, :, :] for image in video]
+
+    for maskgen_file, path in zip(args.maskgen_files, args.paths):
+
+        fp32 = load_mask_generator(maskgen_file, path).eval()
+        int8 = load_mask_generator(maskgen_file, path, "int8", calibration)
+
+        fp32_latency, fp32_mask = run(fp32, frames, args)
+        int8_latency, int8_mask = run(int8, frames, args)
+
+        iou = (fp32_mask & int8_mask).sum().item() / max(
+            (fp32_mask | int8_mask).sum().item(), 1
+        )
+        logger.info(
+            "%s: fp32 %.4f sec/frame, int8 %.4f sec/frame (%.2fx), IoU %.3f, "
+            "%d boundaries",
+            maskgen_file,
+            fp32_latency,
+            int8_latency,
+            fp32_latency / int8_latency,
+            iou,
+            count_boundaries(int8),
+        )
+
+
+if __name__ == "__main__":
+
+    coloredlogs.install(
+        fmt="%(asctime)s [%(levelname)s] %(name)s:%(funcName)s[%(lineno)s] -- %(message)s",
+        level="INFO",
+    )
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", type=str, required=True)
+    parser.add_argument("--maskgen_files", type=str, nargs="+", required=True)
+    parser.add_argument(
+        "-p",
+        "--paths",
+        type=str,
+        nargs="+",
+        help="The checkpoint of each maskgen file.",
+        required=True,
+    )
+    parser.add_argument("--calibration_frames", type=int, default=16)
+    parser.add_argument("--num_frames", type=int, default=50)
+    parser.add_argument("--bound", type=float, default=0.2)
+    parser.add_argument("--conv_size", type=int, default=1)
+    parser.add_argument("--num_threads", type=int, default=4)
+
+    args = parser.parse_args()
+
+    assert len(args.maskgen_files) == len(args.paths)
+
+    main(args)
@@ -0,0 +1,69 @@
+"""
+    Compare reading pickled and columnar results, and check that both hold
+    the same instances. The columnar copy is written next to the pickle.
+    Run from the repository root:
+    python -m measurements.benchmark_results_store \
+        -i results/COCO-Detection/faster_rcnn_R_101_FPN_3x.yaml/videos/dashcamcropped_1_qp_30.mp4
+"""
+
+import argparse
+import logging
+import pickle
+import time
+
+import coloredlogs
+import torch
+
+from utilities.results_store import ColumnarResults, is_columnar, write_columns
+
+
+def main(args):
+
+    logger = logging.getLogger("benchmark_results_store")
+
+    assert not is_columnar(args.input), "Convert a pickled results file."
+    columnar_file = args.input + ".columns"
+
+    tstart = time.time()
+    with open(args.input, "rb") as f:
+        results = pickle.load(f)
+    logger.info("pickle: read in %.3f sec", time.time() - tstart)
+
+    write_columns(columnar_file, results)
+
+    tstart = time.time()
+    columnar = ColumnarResults(columnar_file)
+    logger.info("columnar: opened in %.3f sec", time.time() - tstart)
+
+    tstart = time.time()
+    frames = {fid: columnar[fid] for fid in columnar}
+    logger.info(
+        "columnar: built all instances in %.3f sec", time.time() - tstart
+    )
+
+    assert sorted(frames.keys()) == sorted(results.keys())
+    for fid, result in results.items():
+        expected = result["instances"].get_fields()
+        actual = frames[fid]["instances"].get_fields()
+        assert expected.keys() == actual.keys()
+        for name in expected:
+            x, y = expected[name], actual[name]
+            if hasattr(x, "tensor"):
+                x, y = x.tensor, y.tensor
+            assert x.dtype == y.dtype and torch.equal(x, y), (fid, name)
+    logger.info("%d frames are identical.", len(results))
+
+
+if __name__ == "__main__":
+
+    coloredlogs.install(
+        fmt="%(asctime)s [%(levelname)s] %(name)s:%(funcName)s[%(lineno)s] -- %(message)s",
+        level="INFO",
+    )
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", type=str, required=True)
+
+    args = parser.parse_args()
+
+    main(args)
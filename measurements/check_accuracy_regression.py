@@ -0,0 +1,257 @@
+"""
+    Check that the vectorized accuracy computation, per frame, over the
+    whole video and in a threshold sweep, returns exactly the same metrics
+    as the original per-box loops, over saved results and a grid of
+    thresholds. Also report the time each takes.
+    Run from the repository root:
+    python -m measurements.check_accuracy_regression \
+        -i dashcamcropped_1_qp_30.mp4 \
+        --ground_truth dashcamcropped_1_qp_24.mp4 \
+        --app COCO-Detection/faster_rcnn_R_101_FPN_3x.yaml
+"""
+
+import argparse
+import itertools
+import logging
+import time
+from copy import copy
+
+import coloredlogs
+import torch
+from detectron2.structures.boxes import pairwise_iou
+
+from dnn.dnn_factory import DNN_Factory
+from utilities.results_utils import read_results
+
+
+def reference_filter_result(app, result, args, gt=False):
+
+    scores = result["instances"].scores
+    class_ids = result["instances"].pred_classes
+
+    inds = scores < 0
+    for i in app.class_ids:
+        inds = inds | (class_ids == i)
+    if gt:
+        inds = inds & (scores > args.gt_confidence_threshold)
+    else:
+        inds = inds & (scores > args.confidence_threshold)
+
+    return {"instances": result["instances"][inds]}
+
+
+def reference_calc_accuracy_detection(app, result_dict, gt_dict, args):
+    """
+        The loops replaced in Accuracy.calc_accuracy_detection.
+    """
+
+    f1s = []
+    prs = []
+    res = []
+    tps = []
+    fps = []
+    fns = []
+
+    for fid in result_dict.keys():
+        result = reference_filter_result(app, result_dict[fid], args, False)
+        gt = reference_filter_result(app, gt_dict[fid], args, True)
+
+        result = result["instances"]
+        gt = gt["instances"]
+
+        if len(result) == 0 or len(gt) == 0:
+            if len(result) == 0 and len(gt) == 0:
+                f1s.append(1.0)
+                prs.append(1.0)
+                res.append(1.0)
+            else:
+                f1s.append(0.0)
+                prs.append(0.0)
+                res.append(0.0)
+
+        IoU = pairwise_iou(result.pred_boxes, gt.pred_boxes)
+
+        for i in range(len(result)):
+            for j in range(len(gt)):
+                if result.pred_classes[i] != gt.pred_classes[j]:
+                    IoU[i, j] = 0
+
+        tp = 0
+
+        for i in range(len(gt)):
+            if sum(IoU[:, i] > args.iou_threshold):
+                tp += 1
+        fn = len(gt) - tp
+        fp = len(result) - tp
+        fp = max(fp, 0)
+
+        if 2 * tp + fp + fn == 0:
+            f1 = 1.0
+        else:
+            f1 = 2 * tp / (2 * tp + fp + fn)
+        if tp + fp == 0:
+            pr = 1.0
+        else:
+            pr = tp / (tp + fp)
+        if tp + fn == 0:
+            re = 1.0
+        else:
+            re = tp / (tp + fn)
+
+        f1s.append(f1)
+        prs.append(pr)
+        res.append(re)
+        tps.append(tp)
+        fps.append(fp)
+        fns.append(fn)
+
+    sum_tp = sum(tps)
+    sum_fp = sum(fps)
+    sum_fn = sum(fns)
+
+    if 2 * sum_tp + sum_fp + sum_fn == 0:
+        sum_f1 = 1.0
+    else:
+        sum_f1 = 2 * sum_tp / (2 * sum_tp + sum_fp + sum_fn)
+
+    return {
+        "f1": torch.tensor(f1s).mean().item(),
+        "pr": torch.tensor(prs).mean().item(),
+        "re": torch.tensor(res).mean().item(),
+        "tp": torch.tensor(tps).sum().item(),
+        "fp": torch.tensor(fps).sum().item(),
+        "fn": torch.tensor(fns).sum().item(),
+        "sum_f1": sum_f1,
+    }
+
+
+def main(args):
+
+    logger = logging.getLogger("check_accuracy_regression")
+
+    app = DNN_Factory().get_accuracy(args.app)
+    assert app.type == "Detection", "Only detection accuracy is vectorized."
+
+    # the stored results, columnar ones are packed from their columns.
+    gt_results = read_results(args.ground_truth, app.name, logger)
+    gt_dict = {fid: gt_results[fid] for fid in gt_results}
+
+    for video_name in args.inputs:
+
+        video_results = read_results(video_name, app.name, logger)
+        video_dict = {fid: video_results[fid] for fid in video_results}
+
+        sweeps = {}
+        for iou in args.iou_thresholds:
+            setting = copy(args)
+            setting.iou_threshold = iou
+            tstart = time.time()
+            sweeps[iou] = app.calc_accuracy_detection_sweep(
+                video_dict,
+                gt_dict,
+                setting,
+                args.confidence_thresholds,
+                args.gt_confidence_thresholds,
+            )
+            logger.info(
+                "%s iou %.2f: swept all thresholds in %.3f sec",
+                video_name,
+                iou,
+                time.time() - tstart,
+            )
+
+        for conf, gt_conf, iou in itertools.product(
+            args.confidence_thresholds,
+            args.gt_confidence_thresholds,
+            args.iou_thresholds,
+        ):
+            setting = copy(args)
+            setting.confidence_threshold = conf
+            setting.gt_confidence_threshold = gt_conf
+            setting.iou_threshold = iou
+
+            tstart = time.time()
+            expected = reference_calc_accuracy_detection(
+                app, video_dict, gt_dict, setting
+            )
+            reference_time = time.time() - tstart
+
+            tstart = time.time()
+            per_frame = app.calc_accuracy_detection(
+                video_dict, gt_dict, setting
+            )
+            per_frame_time = time.time() - tstart
+
+            tstart = time.time()
+            whole_video = app.calc_accuracy_detection_video(
+                video_dict, gt_dict, setting
+            )
+            whole_video_time = time.time() - tstart
+
+            stored = app.calc_accuracy_detection_video(
+                video_results, gt_results, setting
+            )
+
+            assert per_frame == expected, (video_name, conf, gt_conf, iou)
+            assert whole_video == expected, (video_name, conf, gt_conf, iou)
+            assert stored == expected, (video_name, conf, gt_conf, iou)
+            assert sweeps[iou][conf, gt_conf] == expected, (
+                video_name,
+                conf,
+                gt_conf,
+                iou,
+            )
+            logger.info(
+                "%s conf %.2f gt_conf %.2f iou %.2f: identical, "
+                "%.3f sec (loops), %.3f sec (per frame), "
+                "%.3f sec (whole video)",
+                video_name,
+                conf,
+                gt_conf,
+                iou,
+                reference_time,
+                per_frame_time,
+                whole_video_time,
+            )
+
+
+if __name__ == "__main__":
+
+    coloredlogs.install(
+        fmt="%(asctime)s [%(levelname)s] %(name)s:%(funcName)s[%(lineno)s] -- %(message)s",
+        level="INFO",
+    )
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-i",
+        "--inputs",
+        nargs="+",
+        help="The video results to examine.",
+        required=True,
+    )
+    parser.add_argument("--ground_truth", type=str, required=True)
+    parser.add_argument(
+        "--app",
+        type=str,
+        default="COCO-Detection/faster_rcnn_R_101_FPN_3x.yaml",
+    )
+    parser.add_argument(
+        "--confidence_thresholds",
+        type=float,
+        nargs="+",
+        default=[0.3, 0.5, 0.7],
+    )
+    parser.add_argument(
+        "--gt_confidence_thresholds",
+        type=float,
+        nargs="+",
+        default=[0.3, 0.5, 0.7],
+    )
+    parser.add_argument(
+        "--iou_thresholds", type=float, nargs="+", default=[0.3, 0.5]
+    )
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,115 @@
+"""
+    Check both paths of quantize_mask_generator on small FCNs:
+    a traceable FCN is returned as one quantized GraphModule, and an FCN
+    whose forward cannot be traced (it splits its input batch and checks
+    the type of its layers, like maskgen/mobilenet_v2.py) keeps its own
+    modules. Its iterated nn.Sequential is fused in place, and the
+    nn.Sequential that a residual block only calls is quantized as a whole.
+    Run from the repository root:
+    python -m measurements.check_quantization
+"""
+
+import argparse
+import logging
+
+import coloredlogs
+import torch
+import torch.nn as nn
+from torch.fx import GraphModule
+
+from utilities.maskgen_utils import quantize_mask_generator
+
+
+def conv_bn(inp, oup, stride):
+    return nn.Sequential(
+        nn.Conv2d(inp, oup, 3, stride, 1, bias=False),
+        nn.BatchNorm2d(oup),
+        nn.ReLU(inplace=True),
+    )
+
+
+class Residual(nn.Module):
+    def __init__(self, channels):
+        super().__init__()
+        self.conv = conv_bn(channels, channels, 1)
+        self.stride = 1
+
+    def forward(self, x):
+        return x + self.conv(x)
+
+
+class TracedFCN(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.features = nn.Sequential(conv_bn(3, 16, 2), Residual(16))
+        self.head = nn.Conv2d(16, 2, 1)
+
+    def forward(self, x):
+        return self.head(self.features(x))
+
+
+class UntracedFCN(TracedFCN):
+    def forward(self, x):
+        # iterating over a traced tensor cannot be traced.
+        x = torch.cat([frame for frame in x.split(1)])
+        for layer in self.features:
+            if isinstance(layer, Residual) and layer.stride == 1:
+                x = layer(x)
+            else:
+                x = layer(x)
+        return self.head(x)
+
+
+def relative_error(expected, actual):
+    return ((expected - actual).norm() / expected.norm()).item()
+
+
+def main(args):
+
+    logger = logging.getLogger("check_quantization")
+    torch.manual_seed(0)
+
+    frames = [torch.rand(1, 3, 64, 64) for _ in range(args.num_frames)]
+    x = torch.rand(2, 3, 64, 64)
+
+    for fcn in [TracedFCN(), UntracedFCN()]:
+        name = type(fcn).__name__
+        fcn.eval()
+        with torch.no_grad():
+            expected = fcn(x)
+        quantized = quantize_mask_generator(fcn, frames)
+        with torch.no_grad():
+            actual = quantized(x)
+
+        if isinstance(fcn, UntracedFCN):
+            assert quantized is fcn, "The untraceable FCN must be kept."
+            assert isinstance(quantized.features, nn.Sequential)
+            assert isinstance(quantized.features[0][0], GraphModule)
+            assert isinstance(quantized.features[0][1], nn.Identity)
+            assert isinstance(quantized.features[1], Residual)
+            assert isinstance(quantized.features[1].conv, GraphModule)
+            assert isinstance(quantized.head, GraphModule)
+        else:
+            assert isinstance(quantized, GraphModule)
+
+        error = relative_error(expected, actual)
+        logger.info("%s: relative error %.4f", name, error)
+        assert error < args.max_error, name
+
+    logger.info("Both quantization paths work.")
+
+
+if __name__ == "__main__":
+
+    coloredlogs.install(
+        fmt="%(asctime)s [%(levelname)s] %(name)s:%(funcName)s[%(lineno)s] -- %(message)s",
+        level="INFO",
+    )
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_frames", type=int, default=8)
+    parser.add_argument("--max_error", type=float, default=0.1)
+
+    args = parser.parse_args()
+
+    main(args)
@@ -20,11 +20,11 @@ from torchvision import io
 
 from dnn.fasterrcnn_resnet50 import FasterRCNN_ResNet50_FPN
 from maskgen.fcn_16_single_channel import FCN
-from utils.bbox_utils import center_size
-from utils.loss_utils import focal_loss as get_loss
-from utils.mask_utils import *
-from utils.results_utils import read_ground_truth, read_results
-from utils.video_utils import get_qp_from_name, read_videos, write_video
+from utilities.bbox_utils import center_size
+from utilities.loss_utils import focal_loss as get_loss
+from utilities.mask_utils import *
+from utilities.results_utils import read_ground_truth, read_results
+from utilities.video_utils import get_qp_from_name, read_videos, write_video
 
 sns.set()
 
@@ -182,7 +182,9 @@ def main(args):
     qps = [min(qps)]
     if args.force_qp:
         qps = [args.force_qp]
-    write_black_bkgd_video_smoothed_continuous(mask, args, qps, bws, logger)
+    write_black_bkgd_video_smoothed_continuous(
+        mask, args, qps[0], logger, streaming=args.streaming
+    )
     # masked_video = generate_masked_video(mask, videos, bws, args)
     # write_video(masked_video, args.output, logger)
 
@@ -258,6 +260,12 @@ if __name__ == "__main__":
     parser.add_argument(
         "--visualize", type=bool, help="Visualize the mask if True", default=False,
     )
+    parser.add_argument(
+        "--streaming",
+        help="Pipe the composited frames to ffmpeg instead of writing pngs.",
+        default=False,
+        action="store_true",
+    )
     parser.add_argument("--force_qp", type=int, required=True)
 
     # parser.add_argument('--mask', type=str,
@@ -25,11 +25,11 @@ from dnn.dnn_factory import DNN_Factory
 from maskgen.fcn_16_single_channel import FCN
 from PIL import Image
 from torchvision import io
-from utils.bbox_utils import center_size
-from utils.loss_utils import focal_loss as get_loss
-from utils.mask_utils import *
-from utils.results_utils import read_ground_truth, read_results
-from utils.video_utils import get_qp_from_name, read_videos, write_video
+from utilities.bbox_utils import center_size
+from utilities.loss_utils import focal_loss as get_loss
+from utilities.mask_utils import *
+from utilities.results_utils import read_ground_truth, read_results
+from utilities.video_utils import get_qp_from_name, read_videos, write_video
 
 sns.set()
 
@@ -102,7 +102,9 @@ def main(args):
             total=len(videos[-1]), desc=f"{application.name}", unit="frames"
         )
 
-        write_black_bkgd_video_smoothed_continuous(mask, args, qps, bws, logger)
+        write_black_bkgd_video_smoothed_continuous(
+            mask, args, qps[0], logger, streaming=args.streaming
+        )
         subprocess.run(["python", "inference.py", "-i", args.output])
         inference_results = read_results(args.output, application.name, logger)
 
@@ -136,7 +138,9 @@ def main(args):
                 mask[fid : fid + 1, :, :, :], regions[fid], 0, args.tile_size
             )
 
-    write_black_bkgd_video_smoothed_continuous(mask, args, qps, bws, logger)
+    write_black_bkgd_video_smoothed_continuous(
+        mask, args, qps[0], logger, streaming=args.streaming
+    )
     # masked_video = generate_masked_video(mask, videos, bws, args)
     # write_video(masked_video, args.output, logger)
 
@@ -227,6 +231,12 @@ if __name__ == "__main__":
         default=False,
     )
     parser.add_argument("--conv_size", type=int, required=True)
+    parser.add_argument(
+        "--streaming",
+        help="Pipe the composited frames to ffmpeg instead of writing pngs.",
+        default=False,
+        action="store_true",
+    )
     parser.add_argument("--force_qp", type=int, default=-1)
 
     # parser.add_argument('--mask', type=str,
@@ -0,0 +1,41 @@
+"""
+    Atomic file writes, shared by the caches and result stores that several
+    processes read and write at once. A file is written to a unique temporary
+    file next to it, then renamed over it, so readers never observe a partial
+    file, and concurrent writers never write to the same temporary file.
+"""
+
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+def temp_file(filename):
+    """
+        Create a unique, empty temporary file in the directory of filename,
+        and return its name. Rename it over filename with os.replace once it
+        is complete.
+    """
+    directory, basename = os.path.split(os.path.abspath(filename))
+    fd, tmp = tempfile.mkstemp(
+        suffix=".tmp", prefix=f"{basename}.{os.getpid()}.", dir=directory
+    )
+    os.close(fd)
+    return tmp
+
+
+@contextmanager
+def atomic_write(filename):
+    """
+        Yield the name of a temporary file, which replaces filename if the
+        block completes, and is removed otherwise. Usage:
+        with atomic_write("heat.pth") as tmp:
+            torch.save(heat, tmp)
+    """
+    tmp = temp_file(filename)
+    try:
+        yield tmp
+        os.replace(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
@@ -1,8 +1,11 @@
+import fcntl
 import glob
 import os
 import pickle
 import subprocess
+import tempfile
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from pdb import set_trace
 from shutil import copytree, rmtree
@@ -16,15 +19,35 @@ from config import settings
 
 # from utils.compressor import *
 from utilities.mask_utils import tile_mask
+from utilities.video_utils import RawVideoPipe, VideoStream, no_postprocess
+
+
+def write_qp_matrix(mask, filename):
+    """
+        Write the [N, H, W] qp mask in the format read by the patched x264:
+        one line per macroblock row, each qp followed by a space.
+        The whole mask is formatted in one pass instead of indexing the tensor
+        once per macroblock.
+    """
+    rows = mask.reshape(-1, mask.shape[-1]).tolist()
+    with open(filename, "w") as qp_file:
+        qp_file.write(
+            "".join(" ".join(map(str, row)) + " \n" for row in rows)
+        )
 
 
-def black_background_compressor(mask, args, logger, writer):
+def black_background_compressor(mask, args, logger, writer, streaming=False):
+    """
+        With streaming=True, the source is decoded in-process and the
+        composited frames are piped to ffmpeg as rawvideo, without any png.
+    """
 
     # cleanup previous results
     subprocess.run(["rm", "-r", args.output + "*"])
     if Path(f"{args.output}.source.pngs").exists():
         rmtree(f"{args.output}.source.pngs")
-    Path(f"{args.output}.source.pngs").mkdir()
+    if not streaming:
+        Path(f"{args.output}.source.pngs").mkdir()
 
     # dump args for decoding purpose.
     with open(f"{args.output}.args", "wb") as f:
@@ -40,6 +63,33 @@ def black_background_compressor(mask, args, logger, writer):
     mean = torch.Tensor([0.0, 0.0, 0.0])
     background = None
 
+    def composite(fid, image, mask_slice):
+        nonlocal background
+
+        # extract mask
+        mask_slice = tile_mask(mask_slice, args.tile_size)
+
+        # construct uniform color background
+        if background is None:
+            background = torch.ones_like(image) * mean[None, :, None, None]
+
+        # construct image
+        image = torch.where(mask_slice == 1, image, background)
+        if writer is not None and fid % args.visualize_step_size == 0:
+            writer.add_image("before_encode", image[0], fid)
+        return image
+
+    if streaming:
+        logger.info(f"Gernerate compressed video {args.output}")
+        source = VideoStream(args.source, no_postprocess, logger)
+        with RawVideoPipe(["-qp", f"{args.qp}", args.output]) as pipe:
+            for fid, (image, mask_slice) in enumerate(
+                zip(tqdm(source), mask.split(1))
+            ):
+                image = composite(fid, image.unsqueeze(0), mask_slice)
+                pipe.write(image[0])
+        return
+
     # generate source pngs
     subprocess.run(["rm", "-r", f"{args.source}.pngs"])
     Path(f"{args.source}.pngs").mkdir()
@@ -70,17 +120,8 @@ def black_background_compressor(mask, args, logger, writer):
             # read image
             image = T.ToTensor()(Image.open(input_filename)).unsqueeze(0)
 
-            # extract mask
-            mask_slice = tile_mask(mask_slice, args.tile_size)
-
-            # construct uniform color background
-            if background is None:
-                background = torch.ones_like(image) * mean[None, :, None, None]
-
             # construct and write image
-            image = torch.where(mask_slice == 1, image, background)
-            if writer is not None and fid % args.visualize_step_size == 0:
-                writer.add_image("before_encode", image[0], fid)
+            image = composite(fid, image, mask_slice)
             image = T.ToPILImage()(image[0])
             executor.submit(image.save, output_filename)
 
@@ -275,13 +316,7 @@ def h264_roi_compressor(mask, args, logger):
 
     logger.info("Dumping roi files...")
 
-    with open("/tank/kuntai/code/qp_matrix_file", "w") as qp_file:
-
-        for i in range(mask.shape[0]):
-            for j in range(mask.shape[1]):
-                for k in range(mask.shape[2]):
-                    qp_file.write(f"{mask[i,j,k]} ")
-                qp_file.write("\n")
+    write_qp_matrix(mask, "/tank/kuntai/code/qp_matrix_file")
 
     logger.info("Encoding...")
 
@@ -302,44 +337,70 @@ def h264_roi_compressor(mask, args, logger):
     )
 
 
-def h264_roi_compressor_segment(mask_full, args, logger):
+def qp_matrix_env():
+    """
+        The environment variable through which the patched x264 reads the path
+        of its qp matrix. When it is not configured, x264 reads the fixed
+        {x264_dir}/qp_matrix_file, so only one segment can be encoded at a
+        time on a machine.
+    """
+    return settings.get("x264_qp_matrix_env", "")
+
+
+@contextmanager
+def encoding_slot(poll=1):
+    """
+        Hold one of the encoding_slots (default: the number of cores) slots
+        shared by all processes on this machine. Slots are flock()ed files in
+        encoding_lock_dir, so a crashed process releases its slot.
+    """
+    num_slots = settings.get("encoding_slots", os.cpu_count())
+    lock_dir = Path(settings.get("encoding_lock_dir", tempfile.gettempdir()))
+    while True:
+        for i in range(num_slots):
+            f = open(lock_dir / f"accmpeg_encoding_slot_{i}.lock", "a")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                continue
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+                f.close()
+            return
+        sleep(poll)
+
+
+def encode_roi_segment(mask, st, idx, args, logger):
+    """
+        Encode frames [st, st + len(mask)) of args.source with the [N, H, W]
+        qp mask, into args.output.part_{idx}.mp4. Return the part's filename.
+    """
 
     x264_dir = settings.x264_dir
-
-    mask_full = mask_full.squeeze(1)
-    num_pngs = mask_full.shape[0]
     ffmpeg_env = os.environ.copy()
     ffmpeg_env["LD_LIBRARY_PATH"] = f"{x264_dir}/lib"
 
-    filenames = ""
-
-    while os.path.exists("encoding.lock"):
-        print("waiting for encoding finish")
-        sleep(10)
-
-    os.system("touch encoding.lock")
-
-    for idx, slice in enumerate(
-        torch.split(torch.tensor(range(num_pngs)), args.smooth_frames)
-    ):
-
-        st = slice[0]
-        ed = slice[-1]
-        length = ed - st + 1
+    if qp_matrix_env() == "":
+        qp_matrix_file = f"{x264_dir}/qp_matrix_file"
+    else:
+        # each segment gets its own qp matrix, so segments can run in parallel.
+        qp_matrix_file = f"{args.output}.part_{idx}.qp_matrix"
+        ffmpeg_env[qp_matrix_env()] = str(Path(qp_matrix_file).resolve())
 
-        mask = mask_full[st : ed + 1, :, :]
-        logger.info("Encoding segment %d...", idx)
+    # mask_full[0] is the mask of frame args.start of the source.
+    offset = getattr(args, "start", 0)
 
-        with open(f"{x264_dir}/qp_matrix_file", "w") as qp_file:
+    logger.info("Encoding segment %d...", idx)
 
-            for i in range(mask.shape[0]):
-                for j in range(mask.shape[1]):
-                    for k in range(mask.shape[2]):
-                        qp_file.write(f"{mask[i,j,k]} ")
-                    qp_file.write("\n")
+    write_qp_matrix(mask, qp_matrix_file)
 
-        filename = args.output + f".part_{idx}.mp4"
+    filename = args.output + f".part_{idx}.mp4"
 
+    # bound the number of encodes across all jobs on this machine.
+    with encoding_slot():
         subprocess.run(
             [
                 f"{x264_dir}/ffmpeg-3.4.8/ffmpeg",
@@ -349,21 +410,26 @@ def h264_roi_compressor_segment(mask_full, args, logger):
                 "-stats",
                 "-y",
                 "-start_number",
-                f"{st}",
+                f"{offset + st}",
                 "-i",
                 args.source + "/%010d.png",
                 "-frames:v",
-                f"{length}",
+                f"{len(mask)}",
                 filename,
             ],
             env=ffmpeg_env,
         )
 
-        filename = str(Path(filename).resolve())
-        filenames += f"file '{filename}'\n"
+    if qp_matrix_env() != "":
+        os.remove(qp_matrix_file)
+
+    return str(Path(filename).resolve())
+
+
+def concat_roi_segments(filenames, args):
 
     with open(f"{args.output}.txt", "w") as f:
-        f.write(filenames)
+        f.write("".join(f"file '{filename}'\n" for filename in filenames))
 
     subprocess.run(
         [
@@ -388,4 +454,87 @@ def h264_roi_compressor_segment(mask_full, args, logger):
     # cleanup
     os.system(f"rm {args.output}.txt")
     os.system(f"rm {args.output}.part_*.mp4")
-    os.system("rm encoding.lock")
+
+
+class ROISegmentEncoder(object):
+    """
+        Encode the segments of an ROI video in the background as soon as their
+        masks are submitted, then merge them when closed. Each job queues its
+        segments on encoding_workers threads, but the encodes of all jobs on
+        the machine share encoding_slots slots, so concurrent jobs never run
+        more than encoding_slots x264 processes in total. Usage:
+        with ROISegmentEncoder(args, logger) as encoder:
+            encoder.submit(mask, st)
+    """
+
+    def __init__(self, args, logger):
+        self.args = args
+        self.logger = logger
+        self.futures = []
+        self.locked = False
+
+        if qp_matrix_env() == "":
+            num_workers = 1
+        else:
+            num_workers = settings.get("encoding_workers", os.cpu_count())
+
+        self.executor = ThreadPoolExecutor(max_workers=num_workers)
+
+    def lock(self):
+        # all encoders on this machine share one qp matrix file. Only taken
+        # once there is something to encode, so that other jobs do not wait
+        # for the masks of this one.
+        while os.path.exists("encoding.lock"):
+            print("waiting for encoding finish")
+            sleep(10)
+
+        os.system("touch encoding.lock")
+        self.locked = True
+
+    def submit(self, mask, st):
+        """
+            Encode frames [st, st + len(mask)) with the [N, H, W] qp mask.
+        """
+        if qp_matrix_env() == "" and not self.locked:
+            self.lock()
+        self.futures.append(
+            self.executor.submit(
+                encode_roi_segment,
+                mask,
+                st,
+                len(self.futures),
+                self.args,
+                self.logger,
+            )
+        )
+
+    def close(self, merge=True):
+        self.executor.shutdown()
+        try:
+            if merge:
+                filenames = [future.result() for future in self.futures]
+                concat_roi_segments(filenames, self.args)
+        finally:
+            if self.locked:
+                os.system("rm encoding.lock")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        # do not merge a partially encoded video.
+        self.close(merge=type is None)
+
+
+def h264_roi_compressor_segment(mask_full, args, logger):
+
+    mask_full = mask_full.squeeze(1)
+    num_pngs = mask_full.shape[0]
+
+    with ROISegmentEncoder(args, logger) as encoder:
+        for slice in torch.split(
+            torch.tensor(range(num_pngs)), args.smooth_frames
+        ):
+            encoder.submit(
+                mask_full[slice[0] : slice[-1] + 1, :, :], slice[0].item()
+            )
@@ -0,0 +1,132 @@
+"""
+    A content-addressed cache of decoded frames, shared by all pipeline stages.
+    Each video is stored as one uint8 [N, H, W, 3] .npy file named after the
+    hash of the encoded video, and is memory-mapped on read.
+    Enable it by setting frame_cache_dir (e.g. export DYNACONF_FRAME_CACHE_DIR=...).
+    Files are evicted least-recently-used first once the cache grows beyond
+    frame_cache_budget gigabytes. Videos larger than the budget are not
+    cached, and the temporary files of crashed fills are removed on eviction.
+"""
+
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+from config import settings
+from numpy.lib.format import open_memmap
+
+from .atomic import temp_file
+
+
+def cache_dir():
+    return settings.get("frame_cache_dir", "")
+
+
+def enabled():
+    return cache_dir() != ""
+
+
+# hashes computed by this process, keyed by (path, size, mtime).
+_hashes = {}
+
+
+def content_hash(filename, chunk_size=1 << 20):
+    """
+        Hash the content of a file, so that a re-encoded video never hits a
+        stale entry.
+    """
+    stat = os.stat(filename)
+    stamp = (os.path.realpath(filename), stat.st_size, stat.st_mtime_ns)
+    if stamp not in _hashes:
+        h = hashlib.sha1()
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                h.update(chunk)
+        _hashes[stamp] = h.hexdigest()
+    return _hashes[stamp]
+
+
+def _path(key):
+    return Path(cache_dir()) / f"{key}.npy"
+
+
+def open_frames(key):
+    """
+        Return the cached frames as a copy-on-write memmap, or None on a miss.
+    """
+    path = _path(key)
+    if not path.exists():
+        return None
+    # the modification time is the recency used by the LRU eviction.
+    os.utime(path)
+    return np.load(path, mmap_mode="c")
+
+
+def budget():
+    """
+        The size of the cache, in bytes.
+    """
+    return settings.get("frame_cache_budget", 50) * (1 << 30)
+
+
+def create_frames(key, shape):
+    """
+        Allocate a temporary memmap to fill while the video is being decoded.
+        Call commit_frames once it is complete, or discard_frames otherwise.
+        Return (None, None) for videos that alone exceed the budget, as they
+        would be evicted right after being written.
+    """
+    if int(np.prod(shape)) > budget():
+        return None, None
+    Path(cache_dir()).mkdir(parents=True, exist_ok=True)
+    # several streams of the same video may be decoding at once.
+    tmp = temp_file(_path(key))
+    return tmp, open_memmap(tmp, mode="w+", dtype=np.uint8, shape=shape)
+
+
+def commit_frames(key, tmp, frames):
+    frames.flush()
+    del frames
+    os.replace(tmp, _path(key))
+    evict()
+
+
+def discard_frames(tmp):
+    if Path(tmp).exists():
+        os.remove(tmp)
+
+
+def is_stale(tmp):
+    """
+        Whether a temporary file was left by a process that died while
+        filling it. Its name carries the pid of the writer.
+    """
+    try:
+        pid = int(tmp.name.split(".")[-3])
+    except ValueError:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def evict():
+
+    for tmp in Path(cache_dir()).glob("*.tmp"):
+        if is_stale(tmp):
+            discard_frames(tmp)
+
+    entries = sorted(
+        Path(cache_dir()).glob("*.npy"), key=lambda p: p.stat().st_mtime
+    )
+    total = sum(p.stat().st_size for p in entries)
+    for path in entries:
+        if total <= budget():
+            break
+        total -= path.stat().st_size
+        os.remove(path)
@@ -0,0 +1,61 @@
+"""
+    A persistent cache of the raw saliency heat produced by the mask generator.
+    The heat only depends on the video and the generator, not on the
+    parameters that turn it into a mask (--bound, --perc, --conv_size, --hq,
+    --lq), so a parameter sweep only needs to run the generator once.
+    The cache lives in heat_cache_dir (default: heat_cache).
+"""
+
+import hashlib
+from pathlib import Path
+
+import torch
+from config import settings
+
+from .atomic import atomic_write
+from .frame_cache import content_hash
+
+
+def heat_key(video_name, args):
+    """
+        Everything the heat of video_name depends on.
+    """
+    key = [
+        content_hash(video_name),
+        content_hash(args.maskgen_file),
+        content_hash(args.path),
+        args.tile_size,
+        args.start,
+        args.end,
+        args.maskgen_input_size,
+        args.maskgen_backend,
+        args.calibration_frames if args.maskgen_backend == "int8" else None,
+        # batches run the generator in eval mode.
+        args.batch_size > 1,
+        # frames skipped by --sparse keep a placeholder heat.
+        args.smooth_frames if args.sparse else None,
+        args.smooth_policy if args.sparse else None,
+    ]
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+def _path(key):
+    return Path(settings.get("heat_cache_dir", "heat_cache")) / f"{key}.pth"
+
+
+def load_heat(key):
+    """
+        Return the cached [N, 1, H, W] heat, or None on a miss.
+    """
+    path = _path(key)
+    if not path.exists():
+        return None
+    return torch.load(path)
+
+
+def save_heat(key, heat):
+    path = _path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # concurrent sweep points never load a partial file.
+    with atomic_write(path) as tmp:
+        torch.save(heat, tmp)
@@ -373,8 +373,19 @@ def dilate_binarize(mask, lower_bound, kernel_size, cuda=True):
 
 
 def write_black_bkgd_video_smoothed_continuous(
-    mask, args, qp, logger, protect=False, writer=None, tag=None
+    mask,
+    args,
+    qp,
+    logger,
+    protect=False,
+    writer=None,
+    tag=None,
+    streaming=False,
 ):
+    """
+        With streaming=True, the source pngs are composited and piped to ffmpeg
+        as rawvideo, instead of being copied, rewritten and re-read as pngs.
+    """
 
     subprocess.run(["rm", "-r", args.output + "*"])
 
@@ -385,10 +396,11 @@ def write_black_bkgd_video_smoothed_continuous(
     # mask = F.conv2d(mask, torch.ones([1, 1, 3, 3]), stride=1, padding=1)
     # mask = torch.where(mask > 0, torch.ones_like(mask), torch.zeros_like(mask))
 
-    logger.info("Copying source images...")
+    if not streaming:
+        logger.info("Copying source images...")
 
-    os.system(f"rm -r {args.output}.source.pngs")
-    os.system(f"cp -r {args.source} {args.output}.source.pngs")
+        os.system(f"rm -r {args.output}.source.pngs")
+        os.system(f"cp -r {args.source} {args.output}.source.pngs")
 
     # for mask_slice in mask.split(args.smooth_frames):
     #     mask_slice[:, :, :, :] = mask_slice.mean(dim=0, keepdim=True)
@@ -428,6 +440,50 @@ def write_black_bkgd_video_smoothed_continuous(
     if protect:
         mask = dilate_binarize(mask, 0.5, 3, False)
 
+    # assert qps[0] == 22
+    file_extension = args.output.split(".")[-1]
+
+    if file_extension == "mp4":
+        encode_args = ["-qmin", f"{qp}", "-qmax", f"{qp}"]
+    elif file_extension == "hevc":
+        encode_args = ["-c:v", "libx265", "-x265-params", f"qp={qp}"]
+    elif file_extension == "webm":
+        encode_args = [
+            "-c:v",
+            "libvpx-vp9",
+            "-crf",
+            f"{qp}",
+            "-b:v",
+            "0",
+            "-threads",
+            "8",
+        ]
+    else:
+        raise NotImplementedError(f"Cannot encode {args.output}.")
+
+    def composite(fid, image, mask_slice):
+        image = image[None, :, :, :]
+        # generate background
+        mean = torch.Tensor([0.485, 0.456, 0.406])
+        # mean = torch.Tensor([0.0, 0.0, 0.0])
+        background = torch.ones_like(image) * mean[None, :, None, None]
+        # extract mask
+        mask_slice = tile_mask(mask_slice, args.tile_size)
+        # construct image
+        image = torch.where(mask_slice == 1, image, background)
+        if writer is not None and fid % args.visualize_step_size == 0:
+            assert tag is not None, "Please assign a tag for the writer"
+            writer.add_image(tag, image[0], fid)
+        return image[0]
+
+    if streaming:
+        with vu.RawVideoPipe(encode_args + [args.output]) as pipe:
+            for fid, mask_slice in enumerate(tqdm(mask.split(1))):
+                filename = args.source + "/%010d.png" % fid
+                image = T.ToTensor()(Image.open(filename))
+                pipe.write(composite(fid, image, mask_slice))
+        return
+
     with ThreadPoolExecutor(max_workers=4) as executor:
         for fid, mask_slice in enumerate(tqdm(mask.split(1))):
             # read image
@@ -437,76 +493,23 @@ def write_black_bkgd_video_smoothed_continuous(
             # with Timer("save", logger):  # 0.1s
             image = Image.open(filename)
             image = T.ToTensor()(image)
-            image = image[None, :, :, :]
-            # generate background
-            mean = torch.Tensor([0.485, 0.456, 0.406])
-            # mean = torch.Tensor([0.0, 0.0, 0.0])
-            background = torch.ones_like(image) * mean[None, :, None, None]
-            # extract mask
-            mask_slice = tile_mask(mask_slice, args.tile_size)
             # construct and write image
-            image = torch.where(mask_slice == 1, image, background)
-            if writer is not None and fid % args.visualize_step_size == 0:
-                assert tag is not None, "Please assign a tag for the writer"
-                writer.add_image(tag, image[0], fid)
-            image = T.ToPILImage()(image[0])
+            image = composite(fid, image, mask_slice)
+            image = T.ToPILImage()(image)
             executor.submit(image.save, filename)
 
-    # assert qps[0] == 22
-    file_extension = args.output.split(".")[-1]
-
-    if file_extension == "mp4":
-        subprocess.run(
-            [
-                "ffmpeg",
-                "-y",
-                "-i",
-                args.output + ".source.pngs/%010d.png",
-                "-start_number",
-                "0",
-                "-qmin",
-                f"{qp}",
-                "-qmax",
-                f"{qp}",
-                args.output,
-            ]
-        )
-    elif file_extension == "hevc":
-        subprocess.run(
-            [
-                "ffmpeg",
-                "-y",
-                "-i",
-                args.output + ".source.pngs/%010d.png",
-                "-start_number",
-                "0",
-                "-c:v",
-                "libx265",
-                "-x265-params",
-                f"qp={qp}",
-                args.output,
-            ]
-        )
-    elif file_extension == "webm":
-        subprocess.run(
-            [
-                "ffmpeg",
-                "-y",
-                "-i",
-                args.output + ".source.pngs/%010d.png",
-                "-start_number",
-                "0",
-                "-c:v",
-                "libvpx-vp9",
-                "-crf",
-                f"{qp}",
-                "-b:v",
-                "0",
-                "-threads",
-                "8",
-                args.output,
-            ]
-        )
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-y",
+            "-i",
+            args.output + ".source.pngs/%010d.png",
+            "-start_number",
+            "0",
+        ]
+        + encode_args
+        + [args.output]
+    )
 
     os.system(f"rm -r {args.output}.source.pngs")
 
@@ -0,0 +1,278 @@
+import copy
+import importlib
+import inspect
+import logging
+import os
+import re
+
+import torch
+import torch.nn as nn
+from torch.fx.proxy import TraceError
+from torch.quantization.quantize_fx import convert_fx, prepare_fx
+
+from .atomic import atomic_write
+from .video_utils import VideoStream, no_postprocess
+
+backends = ["cuda", "cpu", "onnx", "int8"]
+
+# fp32 generators on the cpu, keyed by their files, once keep_generators() is
+# called, so that a long-lived process builds each one only once.
+generators = None
+
+
+def keep_generators():
+    global generators
+    if generators is None:
+        generators = {}
+
+
+def load_mask_generator(maskgen_file, path, backend="cpu", calibration=None):
+    """
+        Build the FCN defined in maskgen_file and load the parameters in path.
+        backend is one of
+            cuda: the pytorch module on the gpu.
+            cpu: the pytorch module on the cpu.
+            onnx: the module exported to {path}.onnx, run by onnxruntime on
+                the cpu. It is exported in eval mode.
+            int8: the module quantized to int8 on the cpu, in eval mode.
+                calibration is the list of frames to calibrate it on.
+    """
+    assert backend in backends, f"Unknown mask generator backend {backend}."
+
+    key = tuple(
+        (os.path.realpath(f), os.path.getmtime(f)) for f in [maskgen_file, path]
+    )
+    if generators is not None and key in generators:
+        # a copy, since training mode updates the batchnorm statistics.
+        mask_generator = copy.deepcopy(generators[key])
+    else:
+        maskgen_spec = importlib.util.spec_from_file_location(
+            "maskgen", maskgen_file
+        )
+        maskgen = importlib.util.module_from_spec(maskgen_spec)
+        maskgen_spec.loader.exec_module(maskgen)
+        mask_generator = maskgen.FCN()
+        # checkpoints saved on a gpu also load on machines without one.
+        mask_generator.load_state_dict(torch.load(path, map_location="cpu"))
+        if generators is not None:
+            generators[key] = copy.deepcopy(mask_generator)
+
+    if backend == "cuda":
+        return mask_generator.cuda()
+    if backend == "onnx":
+        onnx_file = path + ".onnx"
+        # re-export when the checkpoint or the model definition changes.
+        mtime = os.path.getmtime(onnx_file) if os.path.exists(onnx_file) else 0
+        if mtime < max(map(os.path.getmtime, [path, maskgen_file])):
+            export_onnx(mask_generator, onnx_file)
+        return ONNXMaskGenerator(onnx_file)
+    if backend == "int8":
+        assert calibration, "Quantization needs calibration frames."
+        return quantize_mask_generator(mask_generator, calibration)
+    return mask_generator
+
+
+def calibration_frames(video_name, logger, num_frames=16, size=None):
+    """
+        Read the first num_frames frames of a video to calibrate on.
+    """
+    video = VideoStream(
+        video_name, no_postprocess, logger, end=num_frames, size=size
+    )
+    return [image[None, :, :, :] for image in video]
+
+
+def quantize_mask_generator(mask_generator, frames):
+    """
+        Post-training static int8 quantization, calibrated on frames.
+        Conv+BN+ReLU are fused by torch.fx, and the generator is returned as
+        the converted GraphModule. When its forward cannot be traced, the
+        generator is kept and its children are replaced by their quantized
+        GraphModules instead:
+            a container is replaced as a whole, fused and with a single
+                quantize and dequantize, when the forward of its parent only
+                calls it (e.g. InvertedResidual.conv of mobilenet_v2).
+            other containers and children of a class defined outside
+                torch.nn are kept, as their parent may iterate over them,
+                check their type or read their attributes. Their own
+                children are quantized, after the Conv+BN+ReLU runs of kept
+                nn.Sequential are fused in place.
+            other torch.nn modules are replaced, unless they cannot be
+                traced, in which case their children are quantized.
+    """
+    logger = logging.getLogger("maskgen")
+
+    engine = torch.backends.quantized.engine
+    qconfig_dict = {"": torch.quantization.get_default_qconfig(engine)}
+
+    mask_generator = mask_generator.cpu().eval()
+    if hasattr(mask_generator, "lean_head"):
+        # torch.fx cannot trace its channel bookkeeping.
+        mask_generator.lean_head = False
+
+    try:
+        observed = prepare_fx(mask_generator, qconfig_dict)
+    except TraceError:
+        observed = None
+        logger.info("Cannot trace the generator, quantize its children.")
+
+    if observed is not None:
+        calibrate(observed, frames)
+        logger.info("Quantized the generator with the %s engine.", engine)
+        return convert_fx(observed)
+
+    # (parent, name, observed child) of every replaced child.
+    prepared = []
+    containers = (nn.Sequential, nn.ModuleList, nn.ModuleDict)
+
+    def prepare_children(module, path):
+        for name, child in module.named_children():
+            if isinstance(child, containers):
+                replace = only_called(module, name)
+            else:
+                replace = type(child).__module__.startswith(
+                    "torch.nn"
+                ) and not isinstance(child, nn.Identity)
+            if replace:
+                try:
+                    observed = prepare_fx(child, qconfig_dict)
+                except TraceError:
+                    logger.debug("Cannot trace %s.%s.", path, name)
+                else:
+                    setattr(module, name, observed)
+                    prepared.append((module, name, observed))
+                    continue
+            if isinstance(child, nn.Sequential):
+                fuse_sequential(child)
+            prepare_children(child, f"{path}.{name}")
+
+    prepare_children(mask_generator, "FCN")
+    calibrate(mask_generator, frames)
+    for module, name, observed in prepared:
+        setattr(module, name, convert_fx(observed))
+
+    logger.info(
+        "Quantized %d module(s) with the %s engine.", len(prepared), engine
+    )
+    return mask_generator
+
+
+def only_called(module, name):
+    """
+        Whether the forward of module uses its child name only by calling it,
+        so that the child can be replaced by any module that computes the
+        same function.
+    """
+    try:
+        source = inspect.getsource(type(module).forward)
+    except (OSError, TypeError):
+        return False
+    uses = re.findall(rf"self\.{name}\b(.?)", source)
+    return len(uses) > 0 and all(use == "(" for use in uses)
+
+
+def fuse_sequential(sequential):
+    """
+        Fuse the Conv2d+BatchNorm2d(+ReLU) and Conv2d+ReLU runs of an
+        nn.Sequential in place. Fused modules are replaced by nn.Identity, so
+        the indices of the other modules do not change.
+    """
+    patterns = [
+        (nn.Conv2d, nn.BatchNorm2d, nn.ReLU),
+        (nn.Conv2d, nn.BatchNorm2d),
+        (nn.Conv2d, nn.ReLU),
+    ]
+    names = [name for name, _ in sequential.named_children()]
+    types = [type(child) for child in sequential.children()]
+    runs = []
+    i = 0
+    while i < len(names):
+        for pattern in patterns:
+            if tuple(types[i : i + len(pattern)]) == pattern:
+                runs.append(names[i : i + len(pattern)])
+                i += len(pattern)
+                break
+        else:
+            i += 1
+    if runs:
+        torch.quantization.fuse_modules(sequential, runs, inplace=True)
+
+
+def calibrate(mask_generator, frames):
+    with torch.no_grad():
+        for image in frames:
+            mask_generator(image)
+
+
+def export_onnx(mask_generator, onnx_file, height=720, width=1280):
+    """
+        Export the generator with a dynamic batch size and frame size, and
+        check that onnxruntime reproduces the pytorch output.
+    """
+    logger = logging.getLogger("maskgen")
+    logger.info("Export the mask generator to %s", onnx_file)
+
+    mask_generator = mask_generator.cpu().eval()
+    x = torch.rand(1, 3, height, width)
+    # concurrent sweep jobs may export the same checkpoint.
+    with atomic_write(onnx_file) as tmp:
+        torch.onnx.export(
+            mask_generator,
+            x,
+            tmp,
+            input_names=["input"],
+            output_names=["output"],
+            dynamic_axes={
+                "input": {0: "batch", 2: "height", 3: "width"},
+                "output": {0: "batch"},
+            },
+            opset_version=11,
+        )
+
+        with torch.no_grad():
+            expected = mask_generator(x)
+        actual = ONNXMaskGenerator(tmp)(x)
+        logger.info(
+            "Max abs difference between pytorch and onnxruntime: %.3g",
+            (expected - actual).abs().max().item(),
+        )
+        assert torch.allclose(expected, actual, rtol=1e-3, atol=1e-4)
+
+
+class ONNXMaskGenerator:
+    """
+        An exported generator, called like the pytorch module.
+    """
+
+    device = torch.device("cpu")
+
+    def __init__(self, onnx_file):
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(
+            onnx_file, providers=["CPUExecutionProvider"]
+        )
+
+    def __call__(self, x):
+        output = self.session.run(None, {"input": x.cpu().numpy()})[0]
+        return torch.from_numpy(output)
+
+    def eval(self):
+        # already exported in eval mode.
+        return self
+
+
+def generate_heat(mask_generator, images):
+    """
+        Run the generator on a list of [1, 3, H, W] frames as one batch, and
+        return their [N, 1, 45, 80] heat on the cpu.
+    """
+    if isinstance(mask_generator, ONNXMaskGenerator):
+        device = mask_generator.device
+    else:
+        # quantized generators may have no float parameters left.
+        param = next(mask_generator.parameters(), None)
+        device = torch.device("cpu") if param is None else param.device
+    with torch.no_grad():
+        heat = mask_generator(torch.cat(images).to(device))
+    return heat.softmax(dim=1)[:, 1:2, :, :].cpu()
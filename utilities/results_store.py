@@ -0,0 +1,185 @@
+"""
+    A columnar format for inference results, read through a memory map.
+    The fields of the Instances of all frames are concatenated into one
+    array per field, and frame i owns rows offsets[i]:offsets[i + 1].
+    A file is laid out as
+        MAGIC, the length of the json header (8 bytes, little endian),
+        the json header, the arrays (each aligned to ALIGN bytes)
+    Only results of the form {fid: {"instances": Instances}} whose fields
+    are tensors or Boxes can be stored. Other results stay pickled.
+"""
+
+import json
+import pickle
+import struct
+from collections.abc import Mapping
+
+import numpy as np
+import torch
+from detectron2.structures import Boxes, Instances
+
+from .atomic import atomic_write
+
+MAGIC = b"ACCMPEG-COLUMNS\n"
+ALIGN = 64
+
+
+def aligned(nbytes):
+    return -(-nbytes // ALIGN) * ALIGN
+
+
+def is_columnar(filename):
+    with open(filename, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def can_store(results):
+    """
+        Whether results can be stored in the columnar format.
+    """
+    fields = None
+    for result in results.values():
+        if not isinstance(result, dict) or list(result) != ["instances"]:
+            return False
+        instances = result["instances"]
+        if not isinstance(instances, Instances):
+            return False
+        for value in instances.get_fields().values():
+            if not isinstance(value, (torch.Tensor, Boxes)):
+                return False
+        # all frames must have the same fields.
+        if fields is None:
+            fields = set(instances.get_fields().keys())
+        elif fields != set(instances.get_fields().keys()):
+            return False
+    return True
+
+
+def write_columns(filename, results):
+
+    fids = sorted(results.keys())
+    frames = [results[fid]["instances"] for fid in fids]
+    lengths = [len(instances) for instances in frames]
+
+    columns = {
+        "fids": np.array(fids, dtype=np.int64),
+        "offsets": np.cumsum([0] + lengths, dtype=np.int64),
+        "image_sizes": np.array(
+            [instances.image_size for instances in frames], dtype=np.int64
+        ).reshape(-1, 2),
+    }
+    boxes = []
+    if frames:
+        for name, value in frames[0].get_fields().items():
+            values = [instances.get(name) for instances in frames]
+            if isinstance(value, Boxes):
+                boxes.append(name)
+                values = [value.tensor for value in values]
+            columns[f"field.{name}"] = torch.cat(values).cpu().numpy()
+
+    layout = {"boxes": boxes, "columns": {}}
+    offset = 0
+    for name, column in columns.items():
+        layout["columns"][name] = {
+            "dtype": column.dtype.str,
+            "shape": column.shape,
+            "offset": offset,
+        }
+        offset += aligned(column.nbytes)
+    header = json.dumps(layout).encode()
+
+    with atomic_write(filename) as tmp, open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        start = aligned(f.tell())
+        for name, column in columns.items():
+            f.seek(start + layout["columns"][name]["offset"])
+            f.write(np.ascontiguousarray(column).tobytes())
+
+
+class ColumnarResults(Mapping):
+    """
+        A read-only {fid: {"instances": Instances}} mapping over a columnar
+        file. Instances are built on access, as views of the memory map.
+    """
+
+    def __init__(self, filename):
+
+        with open(filename, "rb") as f:
+            assert f.read(len(MAGIC)) == MAGIC, f"{filename} is not columnar."
+            (length,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(length))
+            start = aligned(f.tell())
+
+        self.boxes = header["boxes"]
+        self.columns = {}
+        for name, column in header["columns"].items():
+            shape = tuple(column["shape"])
+            if np.prod(shape) == 0:
+                self.columns[name] = np.zeros(shape, dtype=column["dtype"])
+                continue
+            # copy-on-write, so that callers may modify the tensors in place.
+            self.columns[name] = np.memmap(
+                filename,
+                dtype=column["dtype"],
+                mode="c",
+                offset=start + column["offset"],
+                shape=shape,
+            )
+
+        self.fields = [
+            name[len("field.") :]
+            for name in self.columns
+            if name.startswith("field.")
+        ]
+        self.index = {
+            fid: i for i, fid in enumerate(self.columns["fids"].tolist())
+        }
+
+    def column(self, name):
+        """
+            The concatenation of a field over all frames, as a tensor.
+        """
+        return torch.from_numpy(self.columns[f"field.{name}"])
+
+    def __getitem__(self, fid):
+
+        i = self.index[fid]
+        st, ed = self.columns["offsets"][i : i + 2].tolist()
+        instances = Instances(tuple(self.columns["image_sizes"][i].tolist()))
+        for name in self.fields:
+            value = self.column(name)[st:ed]
+            instances.set(name, Boxes(value) if name in self.boxes else value)
+        return {"instances": instances}
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+def read_any(filename):
+    """
+        Read a results file in either format.
+    """
+    if is_columnar(filename):
+        return ColumnarResults(filename)
+    with open(filename, "rb") as f:
+        return pickle.load(f)
+
+
+def convert(filename):
+    """
+        Convert a pickled results file to the columnar format, in place.
+        Return whether it was converted.
+    """
+    if is_columnar(filename):
+        return False
+    with open(filename, "rb") as f:
+        results = pickle.load(f)
+    if not can_store(results):
+        return False
+    write_columns(filename, results)
+    return True
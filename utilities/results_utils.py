@@ -1,30 +1,174 @@
+import os
 import pickle
+import struct
 from pathlib import Path
 
 import torch
+from config import settings
 
 from utilities.bbox_utils import jaccard
 
 
 def write_results(video_name, app_name, results, logger):
 
+    # imported here, as it needs detectron2.
+    from utilities import results_store as rs
+
     logger.info(
         f"Writing inference results of application {app_name} on video {video_name}."
     )
     results_file = Path(f"results/{app_name}/{video_name}")
     results_file.parent.mkdir(parents=True, exist_ok=True)
-    with open(results_file, "wb") as f:
-        pickle.dump(results, f)
+    # results that are not Instances (e.g. segmentation) stay pickled.
+    columnar = settings.get("results_format", "columnar") == "columnar"
+    if columnar and rs.can_store(results):
+        rs.write_columns(results_file, results)
+    else:
+        with open(results_file, "wb") as f:
+            pickle.dump(results, f)
 
 
 def read_results(video_name, app_name, logger):
+    """
+        Columnar results are memory-mapped, and their Instances are only
+        built when a frame is accessed.
+    """
+
+    from utilities import results_store as rs
 
     logger.info(
         f"Reading inference results of application {app_name} on video {video_name}."
     )
     results_file = Path(f"results/{app_name}/{video_name}")
-    with open(results_file, "rb") as f:
-        return pickle.load(f)
+    return rs.read_any(results_file)
+
+
+def shard_name(video_name, start, end):
+    """
+        The name under which the results on frames [start, end) are written.
+    """
+    if start == 0 and end is None:
+        return video_name
+    return f"{video_name}.frames_{start}_{'end' if end is None else end}"
+
+
+def merge_result_shards(video_name, app_name, logger):
+    """
+        Merge the results of all shards of a video into one results file.
+        Frame ids are absolute, so the shards are simply unioned.
+    """
+    from utilities import results_store as rs
+
+    results = {}
+    results_file = Path(f"results/{app_name}/{video_name}")
+    shards = results_file.parent.glob(f"{results_file.name}.frames_*")
+    for shard in sorted(shards):
+        logger.info("Merging results from %s", shard)
+        results.update(rs.read_any(shard))
+    write_results(video_name, app_name, results, logger)
+    return results
+
+
+class ResultsWriter:
+    """
+        Append the results of a run to results/{app}/{video}.partial every
+        flush_every frames, so that a crashed run can resume. Each chunk is
+        [length][pickled {fid: result}][footer], and the footer records the
+        length and the frame to resume from. A chunk without a valid footer
+        was torn by a crash, and is dropped on recovery.
+        close() writes the results file and removes the partial file.
+        Frames must be written in increasing order.
+    """
+
+    MAGIC = b"RESCHUNK"
+    HEADER = struct.Struct("<q")
+    FOOTER = struct.Struct("<8sqq")
+
+    def __init__(self, video_name, app_name, logger, flush_every=100):
+
+        self.video_name = video_name
+        self.app_name = app_name
+        self.logger = logger
+        self.flush_every = flush_every
+        self.buffer = {}
+
+        self.path = Path(f"results/{app_name}/{video_name}.partial")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # the frame to resume from, None if nothing is written yet.
+        self.next_fid = None
+        self.recover()
+        self.file = open(self.path, "ab")
+
+    def chunks(self):
+        """
+            Yield (end offset, next fid, payload offset, length) of every
+            complete chunk.
+        """
+        if not self.path.exists():
+            return
+        size = self.path.stat().st_size
+        with open(self.path, "rb") as f:
+            offset = 0
+            while offset + self.HEADER.size <= size:
+                f.seek(offset)
+                (length,) = self.HEADER.unpack(f.read(self.HEADER.size))
+                end = offset + self.HEADER.size + length + self.FOOTER.size
+                if length < 0 or end > size:
+                    return
+                f.seek(end - self.FOOTER.size)
+                magic, footer_length, next_fid = self.FOOTER.unpack(
+                    f.read(self.FOOTER.size)
+                )
+                if magic != self.MAGIC or footer_length != length:
+                    return
+                yield end, next_fid, offset + self.HEADER.size, length
+                offset = end
+
+    def recover(self):
+        end = 0
+        for end, next_fid, _, _ in self.chunks():
+            self.next_fid = next_fid
+        if self.path.exists() and self.path.stat().st_size > end:
+            self.logger.warning("Drop the torn end of %s", self.path)
+            os.truncate(self.path, end)
+        if self.next_fid is not None:
+            self.logger.info(
+                "Resume %s from frame %d.", self.path, self.next_fid
+            )
+
+    def write(self, fid, result):
+        self.buffer[fid] = result
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        payload = pickle.dumps(self.buffer)
+        self.next_fid = max(self.buffer) + 1
+        self.file.write(self.HEADER.pack(len(payload)))
+        self.file.write(payload)
+        self.file.write(
+            self.FOOTER.pack(self.MAGIC, len(payload), self.next_fid)
+        )
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.buffer = {}
+
+    def results(self):
+        results = {}
+        with open(self.path, "rb") as f:
+            for _, _, offset, length in self.chunks():
+                f.seek(offset)
+                results.update(pickle.loads(f.read(length)))
+        return results
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        results = self.results()
+        write_results(self.video_name, self.app_name, results, self.logger)
+        os.remove(self.path)
 
 
 # def merge_results(gt, video, application, args):
@@ -1,21 +1,28 @@
 import glob
+import itertools
 import os
 import subprocess
 from pathlib import Path
 from pdb import set_trace
+from queue import Queue
+from threading import Thread
 
 import av
 import matplotlib.pyplot as plt
+import numpy as np
 import torch
 import torchvision.transforms as T
-from torch.utils.data import DataLoader, Dataset
+from torch.utils.data import DataLoader, Dataset, IterableDataset
 from torchvision import io
 
+from . import frame_cache as fc
 from . import mask_utils as mu
 
 
 class Video(Dataset):
-    def __init__(self, video, postprocess, logger, return_fid=False):
+    def __init__(
+        self, video, postprocess, logger, return_fid=False, start=0, end=None
+    ):
         self.video = video
         logger.info(f"Extract {video} to pngs.")
         Path(f"{video}.pngs").mkdir(exist_ok=True)
@@ -36,6 +43,10 @@ class Video(Dataset):
             ]
         )
         self.nimages = len(glob.glob(f"{video}.pngs/*.png"))
+        if end is not None:
+            self.nimages = min(self.nimages, end)
+        self.nimages = max(self.nimages - start, 0)
+        self.start = start
         self.postprocess = postprocess
         self.return_fid = return_fid
 
@@ -43,6 +54,8 @@ class Video(Dataset):
         return self.nimages
 
     def __getitem__(self, idx):
+        # frame ids are absolute, i.e. they count from the start of the video.
+        idx = self.start + idx
         image = T.ToTensor()(plt.imread(f"{self.video}.pngs/%010d.png" % idx))
         image_post = self.postprocess(image, idx)
         # # just for visualization purpose
@@ -54,6 +67,333 @@ class Video(Dataset):
             return image_post
 
 
+def count_frames(video):
+    """
+        Count the frames of a video without decoding them.
+        Fall back to demuxing when the container does not record the number.
+    """
+    with av.open(video) as container:
+        stream = container.streams.video[0]
+        if stream.frames > 0:
+            return stream.frames
+        return sum(1 for packet in container.demux(stream) if packet.size > 0)
+
+
+def frame_size(video):
+    """
+        The (height, width) of the frames of a video, as encoded.
+    """
+    with av.open(video) as container:
+        stream = container.streams.video[0]
+        return stream.height, stream.width
+
+
+class VideoStream(IterableDataset):
+    """
+        Decode the video in-process through PyAV and yield the frames in order.
+        Nothing is written to disk, and the first frame is available as soon as
+        the decoder produces it.
+        When the frame cache is enabled, a cached video is read from its memmap
+        instead, and a missed one is written through to the cache while it is
+        being decoded.
+        Only frames [start, end) are read. The decoder seeks to the keyframe
+        before start, and frame ids stay absolute. Reading fails if the seek
+        lands after start, rather than mislabel the frames.
+        When size = (height, width) is set, the decoder's scaler resizes the
+        frames while converting them to rgb.
+        When keep(idx, nimages) is set, only the frames it accepts are converted
+        (idx counts from start). The others are still decoded, as later frames
+        depend on them, but are yielded as empty tensors.
+    """
+
+    def __init__(
+        self,
+        video,
+        postprocess,
+        logger,
+        return_fid=False,
+        start=0,
+        end=None,
+        size=None,
+        keep=None,
+    ):
+        self.video = video
+        self.size = size
+        self.keep = keep
+        self.key = None
+        if fc.enabled():
+            self.key = fc.content_hash(video)
+            if size is not None:
+                self.key += "_%dx%d" % tuple(size)
+        frames = None if self.key is None else fc.open_frames(self.key)
+        if frames is not None:
+            logger.info(f"Read {video} from the frame cache.")
+            self.total = len(frames)
+        else:
+            logger.info(f"Stream {video} through PyAV.")
+            self.total = count_frames(video)
+        self.start = start
+        self.end = self.total if end is None else min(end, self.total)
+        self.nimages = max(self.end - self.start, 0)
+        self.postprocess = postprocess
+        self.return_fid = return_fid
+
+    def __len__(self):
+        return self.nimages
+
+    def kept(self, idx):
+        return self.keep is None or self.keep(idx, self.nimages)
+
+    def decode(self):
+        """
+            Yield (absolute frame id, uint8 [H, W, 3] frame), with None for the
+            frames that are not kept.
+        """
+        frames = None if self.key is None else fc.open_frames(self.key)
+        if frames is not None:
+            for idx in range(self.nimages):
+                fid = self.start + idx
+                yield fid, frames[fid] if self.kept(idx) else None
+            return
+
+        with av.open(self.video) as container:
+            stream = container.streams.video[0]
+            stream.thread_type = "AUTO"
+
+            # only cache complete passes over the video.
+            tmp = None
+            full = self.nimages == self.total and self.keep is None
+            if self.size is None:
+                height, width = stream.height, stream.width
+            else:
+                height, width = self.size
+            if self.key is not None and full:
+                shape = (self.total, height, width, 3)
+                tmp, frames = fc.create_frames(self.key, shape)
+
+            first_pts = stream.start_time or 0
+            rate = stream.average_rate
+
+            def timestamp_fid(pts):
+                return round((pts - first_pts) * stream.time_base * rate)
+
+            # the absolute id of the next decoded frame.
+            next_fid = 0
+            if self.start > 0:
+                pts = first_pts + int(self.start / rate / stream.time_base)
+                container.seek(pts, backward=True, stream=stream)
+                # counted from the keyframe the seek lands on, for frames
+                # without timestamps.
+                next_fid = None
+
+            nframes = 0
+            try:
+                for packet in container.demux(stream):
+                    if next_fid is None and packet.dts is not None:
+                        next_fid = timestamp_fid(packet.dts)
+                    for frame in packet.decode():
+                        # timestamps locate start, frames are counted after.
+                        if (
+                            self.start > 0
+                            and nframes == 0
+                            and frame.pts is not None
+                        ):
+                            next_fid = timestamp_fid(frame.pts)
+                        assert (
+                            next_fid is not None
+                        ), f"Cannot seek in {self.video} without timestamps."
+                        fid, next_fid = next_fid, next_fid + 1
+                        # frames between the keyframe and start.
+                        if fid < self.start:
+                            continue
+                        if nframes == self.nimages:
+                            break
+                        # shards are merged by frame id, never mislabel them.
+                        assert nframes > 0 or fid == self.start, (
+                            f"Seeking {self.video} to frame {self.start} "
+                            f"landed on frame {fid}."
+                        )
+                        if not self.kept(nframes):
+                            nframes += 1
+                            yield fid, None
+                            continue
+                        frame = frame.to_ndarray(
+                            format="rgb24", width=width, height=height
+                        )
+                        if frames is not None:
+                            frames[nframes] = frame
+                        nframes += 1
+                        yield fid, frame
+                    if nframes == self.nimages:
+                        break
+                if frames is not None and nframes == self.total:
+                    fc.commit_frames(self.key, tmp, frames)
+                    tmp = None
+            finally:
+                # abandoned or mis-counted stream, do not cache it.
+                if tmp is not None:
+                    fc.discard_frames(tmp)
+
+    def __iter__(self):
+        for fid, frame in self.decode():
+            if frame is None:
+                image_post = torch.empty(0)
+            else:
+                image = torch.from_numpy(frame).permute(2, 0, 1).float()
+                image_post = self.postprocess(image.div_(255), fid)
+            if self.return_fid:
+                yield {
+                    "image": image_post,
+                    "fid": fid,
+                    "video_name": self.video,
+                }
+            else:
+                yield image_post
+
+
+class VideoBatches(IterableDataset):
+    """
+        Worker side of the batched reader: group the decoded frames of a
+        VideoStream into uint8 [B, H, W, 3] tensors, which cross the IPC queue
+        through shared memory at a quarter of the size of float frames.
+    """
+
+    def __init__(self, video, batch_size):
+        assert video.keep is None, "Cannot batch partially converted videos."
+        self.video = video
+        self.batch_size = batch_size
+
+    def __len__(self):
+        return (len(self.video) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        fids, batch = [], []
+        for fid, frame in self.video.decode():
+            fids.append(fid)
+            batch.append(frame)
+            if len(batch) == self.batch_size:
+                yield torch.tensor(fids), torch.from_numpy(np.stack(batch))
+                fids, batch = [], []
+        if batch:
+            yield torch.tensor(fids), torch.from_numpy(np.stack(batch))
+
+
+class BatchedVideo(object):
+    """
+        Consumer side of the batched reader: yield float [B, 3, H, W] batches.
+        The conversion from uint8 (and the move to device) happens once per
+        batch, after the frames left the worker.
+        Like the other readers, its length is the number of frames, so that
+        callers can size their outputs. Iterate unbatch(video) to consume it
+        frame by frame.
+    """
+
+    def __init__(self, video, batch_size, prefetch=2, device=None):
+        self.video = video
+        self.device = device
+        self.loader = DataLoader(
+            VideoBatches(video, batch_size),
+            batch_size=None,
+            num_workers=1,
+            prefetch_factor=prefetch,
+        )
+
+    def __len__(self):
+        return len(self.video)
+
+    def __iter__(self):
+        postprocess = self.video.postprocess
+        for fids, batch in self.loader:
+            if postprocess is no_postprocess and self.device is not None:
+                # move uint8 rather than float to the device.
+                batch = batch.to(self.device, non_blocking=True)
+            batch = batch.permute(0, 3, 1, 2).float().div_(255)
+            if postprocess is not no_postprocess:
+                batch = torch.stack(
+                    [
+                        postprocess(image, fid)
+                        for fid, image in zip(fids.tolist(), batch)
+                    ]
+                )
+                if self.device is not None:
+                    batch = batch.to(self.device, non_blocking=True)
+            yield batch
+
+
+def unbatch(video):
+    """
+        Yield the [1, 3, H, W] frames of any reader one by one. The frames of
+        a batched reader are views of its batches.
+    """
+    for batch in video:
+        yield from batch.split(1)
+
+
+class SharedVideo(object):
+    """
+        Decode a video once for several consumers that iterate it in lockstep,
+        e.g. through zip(*videos). Each consumer gets a view from view().
+    """
+
+    def __init__(self, video, nviews):
+        self.video = video
+        self.nviews = nviews
+        self.branches = []
+
+    def branch(self):
+        # start a new pass over the video once every view got its branch.
+        if not self.branches:
+            self.branches = list(itertools.tee(self.video, self.nviews))
+        return self.branches.pop(0)
+
+    def view(self):
+        return SharedVideoView(self)
+
+
+class SharedVideoView(object):
+    def __init__(self, source):
+        self.source = source
+
+    def __len__(self):
+        return len(self.source.video)
+
+    def __getitem__(self, idx):
+        return self.source.video[idx]
+
+    def __iter__(self):
+        return self.source.branch()
+
+
+def video_keys(video_list):
+    """
+        Videos with the same key decode to the same frames.
+        Paths to the same file share their key. Other files are only hashed,
+        and compared by content, when another input has the same size, so a
+        single input is never read before decoding. Black-background videos
+        are never compared by content, as their frames also depend on the
+        mask stored next to them.
+    """
+    keys = [
+        os.path.realpath(video_name)
+        if os.path.isfile(video_name)
+        else video_name
+        for video_name in video_list
+    ]
+    sizes = {}
+    for key, video_name in zip(keys, video_list):
+        if not os.path.isfile(video_name):
+            continue
+        if "black" in video_name and "base" not in video_name:
+            continue
+        sizes.setdefault(os.path.getsize(key), set()).add(key)
+    hashes = {}
+    for same_size in sizes.values():
+        if len(same_size) > 1:
+            for key in same_size:
+                hashes[key] = fc.content_hash(key)
+    return [hashes.get(key, key) for key in keys]
+
+
 def read_videos(
     video_list,
     logger,
@@ -61,18 +401,58 @@ def read_videos(
     normalize=True,
     dataloader=True,
     from_source=False,
+    streaming=True,
+    batch_size=None,
+    prefetch=2,
+    device=None,
+    start=0,
+    end=None,
+    size=None,
+    keep=None,
 ):
     """
         Read a list of video and return two lists. 
         One is the video tensors, the other is the bandwidths.
+        Set streaming=False to fall back to the png-extraction reader.
+        Set batch_size to get [batch_size, 3, H, W] batches (see read_video).
+        Set start and end to only read frames [start, end).
+        Set size = (height, width) to decode at a lower resolution.
+        Set keep to only convert some frames (see VideoStream).
+        Identical inputs are decoded once and share their frames.
     """
+    keys = video_keys(video_list)
+    sources = {}
+    for key, video_name in zip(keys, video_list):
+        if key not in sources:
+            sources[key] = read_video(
+                video_name,
+                logger,
+                dataloader,
+                from_source,
+                streaming,
+                batch_size=batch_size,
+                prefetch=prefetch,
+                device=device,
+                start=start,
+                end=end,
+                size=size,
+                keep=keep,
+            )
+        else:
+            logger.info(f"{video_name} is a duplicate. Share its frames.")
+    for key in sources:
+        if keys.count(key) > 1:
+            sources[key] = SharedVideo(sources[key], keys.count(key))
+
     video_list = [
         {
-            "video": read_video(video_name, logger, dataloader, from_source),
+            "video": sources[key].view()
+            if isinstance(sources[key], SharedVideo)
+            else sources[key],
             "bandwidth": read_bandwidth(video_name),
             "name": video_name,
         }
-        for video_name in video_list
+        for key, video_name in zip(keys, video_list)
     ]
     if sort:
         video_list = sorted(video_list, key=lambda x: x["bandwidth"])
@@ -90,9 +470,31 @@ def read_videos(
     )
 
 
-def read_video(video_name, logger, dataloader, from_source):
+def no_postprocess(image, fid):
+    return image
+
+
+def read_video(
+    video_name,
+    logger,
+    dataloader,
+    from_source,
+    streaming=True,
+    batch_size=None,
+    prefetch=2,
+    device=None,
+    start=0,
+    end=None,
+    size=None,
+    keep=None,
+):
+    """
+        When batch_size is set, the worker ships uint8 batches of batch_size
+        frames, keeping up to prefetch batches in flight, and the frames are
+        converted to float (and moved to device) on the consumer side.
+    """
     logger.info(f"Reading {video_name}")
-    postprocess = lambda x, fid: x
+    postprocess = no_postprocess
     if "black" in video_name and "base" not in video_name:
         import pickle
 
@@ -112,13 +514,46 @@ def read_video(video_name, logger, dataloader, from_source):
                 )
         postprocess = lambda x, fid: postprocess_black_bkgd(fid, x, mask, args)
     # import pdb; pdb.set_trace()
+    if streaming:
+        video = VideoStream(
+            video_name,
+            postprocess,
+            logger,
+            return_fid=not dataloader,
+            start=start,
+            end=end,
+            size=size,
+            keep=keep,
+        )
+        # one worker decodes ahead of the consumer. More workers would each
+        # replay the whole stream.
+        if batch_size is not None:
+            assert dataloader, "Batched reading needs a dataloader."
+            return BatchedVideo(
+                video, batch_size, prefetch=prefetch, device=device
+            )
+        if dataloader:
+            return DataLoader(video, num_workers=1)
+        else:
+            return video
+    assert size is None, "Only the streaming reader can resize frames."
+    assert keep is None, "Only the streaming reader can skip frames."
     if dataloader:
         return DataLoader(
-            Video(video_name, postprocess, logger), shuffle=False, num_workers=2
+            Video(video_name, postprocess, logger, start=start, end=end),
+            shuffle=False,
+            num_workers=2,
         )
     else:
         # need to return fid
-        return Video(video_name, postprocess, logger, return_fid=True)
+        return Video(
+            video_name,
+            postprocess,
+            logger,
+            return_fid=True,
+            start=start,
+            end=end,
+        )
 
 
 def read_videos_pyav(
@@ -204,6 +639,104 @@ def read_bandwidth(video_name):
         )
 
 
+class RawVideoPipe(object):
+    """
+        Encode frames by writing them as rawvideo into the stdin of ffmpeg.
+        A thread drains a bounded queue into the pipe, so the producer blocks
+        instead of piling frames up in memory when the encoder falls behind.
+        If ffmpeg exits early, the next write raises, and close raises when
+        ffmpeg failed. Usage:
+        with RawVideoPipe(["-qp", "30", "out.mp4"]) as pipe:
+            pipe.write(image)
+    """
+
+    def __init__(self, output_args, fps=25, maxsize=8):
+        self.output_args = output_args
+        self.fps = fps
+        self.queue = Queue(maxsize=maxsize)
+        self.process = None
+        self.thread = None
+        # the error that stopped the drain thread.
+        self.error = None
+
+    def start(self, height, width):
+        self.process = subprocess.Popen(
+            [
+                "ffmpeg",
+                "-hide_banner",
+                "-loglevel",
+                "warning",
+                "-stats",
+                "-y",
+                "-f",
+                "rawvideo",
+                "-pix_fmt",
+                "rgb24",
+                "-s:v",
+                f"{width}x{height}",
+                "-r",
+                f"{self.fps}",
+                "-i",
+                "-",
+            ]
+            + self.output_args,
+            stdin=subprocess.PIPE,
+        )
+        self.thread = Thread(target=self.drain, daemon=True)
+        self.thread.start()
+
+    def drain(self):
+        frame = self.queue.get()
+        while frame is not None:
+            try:
+                self.process.stdin.write(frame)
+            except OSError as e:
+                # ffmpeg exited. Keep emptying the queue, so the producer
+                # never blocks, and report the error on its next write.
+                self.error = e
+            frame = self.queue.get()
+
+    def write(self, image):
+        """
+            Write a [3, H, W] float image in [0, 1].
+        """
+        if self.process is None:
+            self.start(image.shape[1], image.shape[2])
+        if self.error is not None:
+            raise self.error
+        # same quantization as T.ToPILImage, so the encoder sees the same
+        # pixels as it did from pngs.
+        frame = image.mul(255).byte().permute(1, 2, 0).contiguous()
+        self.queue.put(frame.numpy().tobytes())
+
+    def close(self, check=True):
+        """
+            Wait for ffmpeg to finish. With check=True, raise if it failed.
+        """
+        if self.process is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        try:
+            self.process.stdin.close()
+        except OSError as e:
+            self.error = self.error or e
+        returncode = self.process.wait()
+        if not check:
+            return
+        if self.error is not None:
+            raise self.error
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.process.args)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        # do not hide the exception that interrupted the writes.
+        self.close(check=type is None)
+
+
 def write_video(video_tensor, video_name, logger):
 
     logger.info(f"Saving {video_name}")
@@ -0,0 +1,145 @@
+"""
+    A long-lived worker that runs compress_blackgen_roi.py, inference.py and
+    examine.py jobs in one process, so that detectors and mask generators
+    are loaded once per session instead of once per sweep point.
+
+    Start the worker (it serves jobs one at a time, in submission order):
+        python worker.py serve
+    Submit a job, with the arguments the script would take on the command line:
+        python worker.py submit compress_blackgen_roi.py -- -i a.mp4 b.mp4 ...
+    Stop the worker:
+        python worker.py stop
+
+    From python, use run_script(script, argv), which falls back to running
+    the script in a new process when no worker is listening.
+    The worker listens on the unix socket worker_address
+    (default: /tmp/accmpeg_worker.sock).
+"""
+
+import argparse
+import importlib
+import logging
+import os
+import subprocess
+import sys
+import traceback
+from multiprocessing.connection import Client, Listener
+
+import coloredlogs
+from config import settings
+
+scripts = ["compress_blackgen_roi", "inference", "examine"]
+
+
+def worker_address():
+    return settings.get("worker_address", "/tmp/accmpeg_worker.sock")
+
+
+def script_name(script):
+    name = os.path.splitext(os.path.basename(script))[0]
+    assert name in scripts, f"The worker cannot run {script}."
+    return name
+
+
+def serve():
+
+    from dnn.dnn_factory import DNN_Factory
+    from utilities.maskgen_utils import keep_generators
+
+    logger = logging.getLogger("worker")
+
+    DNN_Factory.keep_models()
+    keep_generators()
+
+    address = worker_address()
+    if os.path.exists(address):
+        os.remove(address)
+
+    with Listener(address, family="AF_UNIX") as listener:
+        logger.info("Listening on %s", address)
+        while True:
+            with listener.accept() as conn:
+                job = conn.recv()
+                if job is None:
+                    conn.send(None)
+                    break
+
+                script, argv = job
+                logger.info("Run %s %s", script, " ".join(argv))
+                try:
+                    module = importlib.import_module(script_name(script))
+                    module.main(module.get_parser().parse_args(argv))
+                except (Exception, SystemExit):
+                    # the worker outlives failing jobs, including bad arguments.
+                    error = traceback.format_exc()
+                    logger.error(error)
+                    conn.send(error)
+                else:
+                    conn.send(None)
+
+    logger.info("Stopped.")
+
+
+def submit(script, argv):
+    """
+        Run a job on the worker and wait for it. Raise RuntimeError if the
+        job fails, and ConnectionError or FileNotFoundError if no worker
+        is listening.
+    """
+    with Client(worker_address(), family="AF_UNIX") as conn:
+        conn.send((script, list(argv)))
+        error = conn.recv()
+    if error is not None:
+        raise RuntimeError(f"{script} failed on the worker:\n{error}")
+
+
+def stop():
+    with Client(worker_address(), family="AF_UNIX") as conn:
+        conn.send(None)
+        conn.recv()
+
+
+def run_script(script, argv):
+    """
+        Run a job on the worker, or in a new process if there is none.
+        Return whether it succeeded.
+    """
+    try:
+        submit(script, argv)
+    except (ConnectionError, FileNotFoundError):
+        return subprocess.run([sys.executable, script, *argv]).returncode == 0
+    except RuntimeError as error:
+        logging.getLogger("worker").error(error)
+        return False
+    return True
+
+
+if __name__ == "__main__":
+
+    # set the format of the logger
+    coloredlogs.install(
+        fmt="%(asctime)s [%(levelname)s] %(name)s:%(funcName)s[%(lineno)s] -- %(message)s",
+        level="INFO",
+    )
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("serve", help="Start the worker.")
+    subparsers.add_parser("stop", help="Stop the worker.")
+    submit_parser = subparsers.add_parser("submit", help="Submit a job.")
+    submit_parser.add_argument(
+        "script", type=str, help=f"One of {', '.join(scripts)}."
+    )
+    submit_parser.add_argument(
+        "argv", nargs=argparse.REMAINDER, help="The arguments of the script."
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve()
+    elif args.command == "stop":
+        stop()
+    else:
+        argv = args.argv[1:] if args.argv[:1] == ["--"] else args.argv
+        submit(args.script, argv)